@@ -4,27 +4,49 @@ Telegram bot for battle challenges with leaderboards and statistics.
 """
 
 import os
+import json
+import atexit
+import queue
 import logging
+import logging.handlers
 import asyncio
 import signal
 import sys
+import importlib.util
+from dataclasses import dataclass
 from typing import Optional
 
 from telegram import Update, Bot
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ConversationHandler, Defaults, MessageHandler, filters
 from aiohttp import web
 from aiohttp.web_request import Request
 from aiohttp.web_response import Response
 
-# Configure production logging
+try:
+    import uvloop
+except ImportError:  # uvloop is an optional speedup; fall back to the default event loop
+    uvloop = None
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # orjson is an optional speedup; fall back to the stdlib parser
+    _json_loads = json.loads
+
+# Configure production logging. Records are queued by the calling thread and
+# written by a background listener so log output never blocks the event loop.
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    logging.StreamHandler(sys.stdout),
+    logging.FileHandler('bot.log', mode='a') if os.getenv('LOG_TO_FILE') else logging.NullHandler()
+)
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('bot.log', mode='a') if os.getenv('LOG_TO_FILE') else logging.NullHandler()
-    ]
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Suppress noisy logs in production
@@ -39,15 +61,26 @@ from marbitz_battlebot.handlers import (
     leaderboard_command, weekly_command, stats_command, my_stats_command,
     status_command, cancel_challenge_callback, debug_command,
     wager_callback, wager_amount_handler, cancel_conversation,
-    WAGER_AMOUNT, CHALLENGE_CONFIRMATION
+    WAGER_AMOUNT, CHALLENGE_CONFIRMATION,
+    WAGER_PATTERN, CHALLENGE_RESPONSE_PATTERN, CANCEL_PATTERN
 )
-from marbitz_battlebot.battle import initialize_battle_system
+from marbitz_battlebot.battle import initialize_battle_system, challenge_maintenance_loop, flush_challenges
+from marbitz_battlebot.leaderboard import flush_leaderboards, leaderboard_flush_loop, preload_leaderboards
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Bot settings, read from the environment once at start-up."""
+    bot_token: str
+    webhook_url: str
+    port: int
 
-async def clear_webhook_first(bot_token: str) -> None:
-    """Clear any existing webhook before setting up new one."""
+async def clear_webhook_first(bot: Bot) -> None:
+    """Clear any existing webhook before setting up new one.
+    
+    Uses the application's own bot so the check shares its HTTP connection pool
+    instead of opening (and leaking) a second client.
+    """
     try:
-        bot = Bot(token=bot_token)
-        
         # Get current webhook info
         webhook_info = await bot.get_webhook_info()
         if webhook_info.url:
@@ -57,31 +90,43 @@ async def clear_webhook_first(bot_token: str) -> None:
         else:
             logger.info("No existing webhook to clear")
         
-        await bot.close()
-        
     except Exception as e:
         logger.error(f"Error clearing webhook: {str(e)}")
         raise
 
-async def setup_webhook_bot(bot_token: str, webhook_url: str) -> Application:
+async def setup_webhook_bot(config: Config) -> Application:
     """Set up bot with webhook configuration."""
     
-    # Clear any existing webhook first
-    await clear_webhook_first(bot_token)
-    
     # Initialize battle system
     initialize_battle_system()
     logger.info("Battle system initialized")
     
-    # Create application without updater (webhook mode)
-    application = Application.builder().token(bot_token).updater(None).build()
+    # Keep the leaderboards in memory for the lifetime of the bot
+    preload_leaderboards()
+    
+    # Create application without updater (webhook mode).
+    # Handlers run non-blocking so a long battle sequence doesn't stall other
+    # users' commands. concurrent_updates stays off because ConversationHandler
+    # relies on updates being processed one by one.
+    builder = (
+        Application.builder()
+        .token(config.bot_token)
+        .updater(None)
+        .defaults(Defaults(block=False))
+    )
+    
+    # Multiplex outgoing Bot API calls over one HTTP/2 connection when h2 is installed
+    if importlib.util.find_spec('h2') is not None:
+        builder = builder.http_version('2')
+    
+    application = builder.build()
     
     # Create challenge conversation handler
     challenge_conversation = ConversationHandler(
         entry_points=[CommandHandler('challenge', challenge_command)],
         states={
             WAGER_AMOUNT: [
-                CallbackQueryHandler(wager_callback, pattern=r'^wager_(yes|no)_'),
+                CallbackQueryHandler(wager_callback, pattern=WAGER_PATTERN),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, wager_amount_handler),
             ],
         },
@@ -106,8 +151,8 @@ async def setup_webhook_bot(bot_token: str, webhook_url: str) -> Application:
         CommandHandler('debug', debug_command),
         
         # Callback handlers
-        CallbackQueryHandler(challenge_response_callback, pattern=r'^(accept|decline)_'),
-        CallbackQueryHandler(cancel_challenge_callback, pattern=r'^cancel_'),
+        CallbackQueryHandler(challenge_response_callback, pattern=CHALLENGE_RESPONSE_PATTERN),
+        CallbackQueryHandler(cancel_challenge_callback, pattern=CANCEL_PATTERN),
     ]
     
     for handler in handlers:
@@ -122,12 +167,13 @@ async def setup_webhook_bot(bot_token: str, webhook_url: str) -> Application:
     
     application.add_handler(CallbackQueryHandler(fallback_callback_handler))
     
-    # Initialize and start application
+    # Initialize the application, clear any existing webhook and start
     await application.initialize()
+    await clear_webhook_first(application.bot)
     await application.start()
     
     # Set webhook
-    webhook_endpoint = f"{webhook_url}/webhook"
+    webhook_endpoint = f"{config.webhook_url}/webhook"
     await application.bot.set_webhook(
         url=webhook_endpoint,
         drop_pending_updates=True,
@@ -142,17 +188,19 @@ async def setup_webhook_bot(bot_token: str, webhook_url: str) -> Application:
 async def webhook_handler(request: Request, application: Application) -> Response:
     """Handle incoming webhook requests from Telegram."""
     try:
-        # Parse update data
-        update_data = await request.json()
+        # Parse update data straight from the body bytes
+        update_data = _json_loads(await request.read())
         update_id = update_data.get('update_id', 'unknown')
         
         # Create Update object
         update = Update.de_json(update_data, application.bot)
         
         if update:
-            # Process the update
-            await application.process_update(update)
-            logger.debug(f"Processed update {update_id}")
+            # Hand the update to the application's queue and acknowledge right
+            # away; the update fetcher started by application.start() processes
+            # it in arrival order, so a slow handler never delays Telegram's reply
+            await application.update_queue.put(update)
+            logger.debug(f"Queued update {update_id}")
         else:
             logger.warning(f"Failed to parse update {update_id}")
         
@@ -162,14 +210,17 @@ async def webhook_handler(request: Request, application: Application) -> Respons
         logger.error(f"Error processing webhook: {str(e)}")
         return Response(text="Error", status=500)
 
+# The health payload never changes, so it is serialized once
+_HEALTH_BODY = json.dumps({
+    'status': 'healthy',
+    'service': 'marbitz-battlebot',
+    'mode': 'webhook',
+    'version': '1.0.0'
+}).encode('utf-8')
+
 async def health_check(request: Request) -> Response:
     """Health check endpoint for monitoring."""
-    return web.json_response({
-        'status': 'healthy',
-        'service': 'marbitz-battlebot',
-        'mode': 'webhook',
-        'version': '1.0.0'
-    })
+    return Response(body=_HEALTH_BODY, content_type='application/json')
 
 async def get_webhook_url() -> str:
     """Get webhook URL from environment variables."""
@@ -185,7 +236,8 @@ async def get_webhook_url() -> str:
     # Fallback for Render deployment
     return "https://marbitz-battlebot.onrender.com"
 
-async def shutdown_handler(application: Optional[Application], runner: Optional[web.AppRunner], site: Optional[web.TCPSite]):
+async def shutdown_handler(application: Optional[Application], runner: Optional[web.AppRunner], site: Optional[web.TCPSite],
+                           *background_tasks: asyncio.Task):
     """Clean shutdown handler."""
     logger.info("Shutting down gracefully...")
     
@@ -197,6 +249,14 @@ async def shutdown_handler(application: Optional[Application], runner: Optional[
         await application.stop()
         await application.shutdown()
     
+    # Stop background tasks and write any buffered state before exiting
+    for task in background_tasks:
+        task.cancel()
+    if not flush_leaderboards():
+        logger.error("Failed to flush leaderboards during shutdown")
+    if not flush_challenges():
+        logger.error("Failed to save challenges during shutdown")
+    
     logger.info("Shutdown complete")
 
 async def main():
@@ -207,20 +267,24 @@ async def main():
         logger.critical("BOT_TOKEN environment variable is required")
         sys.exit(1)
     
-    webhook_url = await get_webhook_url()
-    port = int(os.getenv('PORT', 8080))
+    config = Config(
+        bot_token=bot_token,
+        webhook_url=await get_webhook_url(),
+        port=int(os.getenv('PORT', 8080))
+    )
     
     logger.info(f"Starting Marbitz Battlebot")
-    logger.info(f"Webhook URL: {webhook_url}")
-    logger.info(f"Port: {port}")
+    logger.info(f"Webhook URL: {config.webhook_url}")
+    logger.info(f"Port: {config.port}")
     
     application = None
     runner = None
     site = None
+    background_tasks = []
     
     try:
         # Set up bot
-        application = await setup_webhook_bot(bot_token, webhook_url)
+        application = await setup_webhook_bot(config)
         
         # Create web server
         app = web.Application()
@@ -236,36 +300,43 @@ async def main():
         # Start server
         runner = web.AppRunner(app)
         await runner.setup()
-        site = web.TCPSite(runner, '0.0.0.0', port)
+        site = web.TCPSite(runner, '0.0.0.0', config.port)
         await site.start()
         
-        logger.info(f"Bot server started on port {port}")
+        # Persist leaderboard updates and expire/snapshot challenges in the background
+        background_tasks.append(asyncio.create_task(leaderboard_flush_loop()))
+        background_tasks.append(asyncio.create_task(challenge_maintenance_loop()))
+        
+        logger.info(f"Bot server started on port {config.port}")
         logger.info("Bot is ready to receive updates")
         
         # Set up signal handlers for graceful shutdown
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        
         def signal_handler():
             logger.info("Received shutdown signal")
-            raise KeyboardInterrupt()
+            stop_event.set()
         
-        if hasattr(signal, 'SIGTERM'):
-            signal.signal(signal.SIGTERM, lambda s, f: signal_handler())
-        if hasattr(signal, 'SIGINT'):
-            signal.signal(signal.SIGINT, lambda s, f: signal_handler())
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, signal_handler)
+            except NotImplementedError:
+                # Windows event loops don't support add_signal_handler
+                signal.signal(sig, lambda s, f: loop.call_soon_threadsafe(signal_handler))
         
-        # Keep server running
-        try:
-            while True:
-                await asyncio.sleep(1)
-        except KeyboardInterrupt:
-            pass
+        # Keep server running until a shutdown signal arrives
+        await stop_event.wait()
             
     except Exception as e:
         logger.critical(f"Critical error: {str(e)}")
         raise
     finally:
-        await shutdown_handler(application, runner, site)
+        await shutdown_handler(application, runner, site, *background_tasks)
 
 if __name__ == '__main__':
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
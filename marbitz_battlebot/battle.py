@@ -5,12 +5,14 @@ This module handles battle mechanics including battle storylines and winner dete
 Challenge management is handled by the ChallengeManager class in the state module.
 """
 
+import asyncio
 import logging
 import random
+from functools import lru_cache
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Mapping, Optional, Tuple
 
-from marbitz_battlebot.state import ChallengeManager
+from marbitz_battlebot.state import Challenge, ChallengeManager
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -18,9 +20,13 @@ logger = logging.getLogger(__name__)
 # Get the challenge manager instance
 challenge_manager = ChallengeManager()
 
+# Seconds between expired-challenge sweeps (each sweep also saves pending changes)
+CHALLENGE_SWEEP_INTERVAL = 60
+
 def initialize_battle_system() -> None:
     """Initialize the battle system."""
-    # The ChallengeManager initializes itself when instantiated
+    # The ChallengeManager reads the stored challenges on first use; doing it here
+    # keeps that read at startup instead of in the first handler that needs it
     logger.info(f"Battle system initialized with {challenge_manager.get_challenge_count()} active challenges")
 
 def create_challenge(challenger: str, challenged: str, wager_amount: int = 0) -> str:
@@ -66,7 +72,7 @@ def create_challenge(challenger: str, challenged: str, wager_amount: int = 0) ->
         logger.error(f"Error creating challenge: {str(e)}")
         raise
 
-def get_challenge(challenge_id: str) -> Optional[Dict[str, Any]]:
+def get_challenge(challenge_id: str) -> Optional[Challenge]:
     """Get a challenge by ID.
     
     Args:
@@ -77,6 +83,24 @@ def get_challenge(challenge_id: str) -> Optional[Dict[str, Any]]:
     """
     return challenge_manager.get_challenge(challenge_id)
 
+@lru_cache(maxsize=256)
+def _expiry_times(created_at: datetime, expiry_hours: int) -> Tuple[datetime, str, str]:
+    """Compute a challenge's expiry time and display strings, which never change.
+    
+    Args:
+        created_at: When the challenge was created
+        expiry_hours: Number of hours after which a challenge expires
+        
+    Returns:
+        Tuple of the expiry time, the formatted creation time and the formatted expiry time
+    """
+    expiry_time = created_at + timedelta(hours=expiry_hours)
+    return (
+        expiry_time,
+        created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        expiry_time.strftime('%Y-%m-%d %H:%M:%S'),
+    )
+
 def get_challenge_status(challenge_id: str, expiry_hours: int = 6) -> Dict[str, Any]:
     """Get the status of a challenge including expiry information.
     
@@ -101,44 +125,34 @@ def get_challenge_status(challenge_id: str, expiry_hours: int = 6) -> Dict[str,
     
     result = {
         'challenge_id': challenge_id,
-        'challenger': challenge_data.get('challenger_user', 'Unknown'),
-        'challenged': challenge_data.get('challenged_user', 'Unknown'),
-        'wager_amount': challenge_data.get('wager_amount', 0),
-        'status': challenge_data.get('status', 'pending')
+        'challenger': challenge_data.challenger,
+        'challenged': challenge_data.challenged,
+        'wager_amount': challenge_data.wager_amount,
+        'status': challenge_data.status
     }
     
     # Calculate expiry information
     try:
-        if 'timestamp' in challenge_data:
-            created_time = datetime.fromisoformat(challenge_data['timestamp'])
-            now = datetime.now()
-            time_elapsed = now - created_time
-            expiry_time = created_time + timedelta(hours=expiry_hours)
-            time_remaining = expiry_time - now
-            
-            result['created_at'] = created_time.strftime('%Y-%m-%d %H:%M:%S')
-            result['expires_at'] = expiry_time.strftime('%Y-%m-%d %H:%M:%S')
-            
-            # Format time remaining in a user-friendly way
-            if time_remaining.total_seconds() > 0:
-                hours, remainder = divmod(int(time_remaining.total_seconds()), 3600)
-                minutes = remainder // 60
-                result['time_remaining'] = f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
-                result['expired'] = False
-            else:
-                result['time_remaining'] = "Expired"
-                result['expired'] = True
-                
-            # Calculate percentage of time elapsed
-            total_seconds = expiry_hours * 3600
-            elapsed_seconds = min(time_elapsed.total_seconds(), total_seconds)
-            result['expiry_percentage'] = int((elapsed_seconds / total_seconds) * 100)
-        else:
-            result['created_at'] = "Unknown"
-            result['expires_at'] = "Unknown"
-            result['time_remaining'] = "Unknown"
+        created_time = challenge_data.created_at
+        expiry_time, result['created_at'], result['expires_at'] = _expiry_times(created_time, expiry_hours)
+        now = datetime.now()
+        time_elapsed = now - created_time
+        time_remaining = expiry_time - now
+        
+        # Format time remaining in a user-friendly way
+        if time_remaining.total_seconds() > 0:
+            hours, remainder = divmod(int(time_remaining.total_seconds()), 3600)
+            minutes = remainder // 60
+            result['time_remaining'] = f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
             result['expired'] = False
-            result['expiry_percentage'] = 0
+        else:
+            result['time_remaining'] = "Expired"
+            result['expired'] = True
+            
+        # Calculate percentage of time elapsed
+        total_seconds = expiry_hours * 3600
+        elapsed_seconds = min(time_elapsed.total_seconds(), total_seconds)
+        result['expiry_percentage'] = int((elapsed_seconds / total_seconds) * 100)
     except Exception as e:
         logger.error(f"Error calculating expiry information: {str(e)}")
         result['created_at'] = "Error"
@@ -224,11 +238,29 @@ def find_user_challenge(username: str) -> Optional[str]:
         logger.error(f"Error finding challenge for user {username}: {str(e)}")
         return None
 
-def get_all_challenges() -> Dict[str, Dict[str, Any]]:
+def find_challenges_for(username: str) -> Dict[str, Challenge]:
+    """Find the challenges waiting for a user's response.
+    
+    Args:
+        username: Username of the challenged user
+        
+    Returns:
+        Dictionary of matching challenges keyed by challenge ID
+    """
+    if not username:
+        return {}
+    
+    try:
+        return challenge_manager.find_challenges_for(username)
+    except Exception as e:
+        logger.error(f"Error finding challenges for user {username}: {str(e)}")
+        return {}
+
+def get_all_challenges() -> Mapping[str, Challenge]:
     """Get all active challenges.
     
     Returns:
-        Dictionary of all active challenges
+        Read-only live view of the active challenges
     """
     return challenge_manager.get_all_challenges()
 
@@ -247,6 +279,32 @@ def cleanup_expired_challenges(expiry_hours: int = 6) -> List[str]:
         
     return challenge_manager.cleanup_expired_challenges(expiry_hours)
 
+def flush_challenges() -> bool:
+    """Write any unsaved challenge changes to storage.
+    
+    Returns:
+        True if the challenges on disk are up to date, False otherwise
+    """
+    return challenge_manager.flush()
+
+async def challenge_maintenance_loop(expiry_hours: int = 6,
+                                     interval: float = CHALLENGE_SWEEP_INTERVAL) -> None:
+    """Periodically drop expired challenges and snapshot the rest to disk.
+    
+    Args:
+        expiry_hours: Number of hours after which a challenge expires
+        interval: Seconds between sweeps
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            expired = cleanup_expired_challenges(expiry_hours)
+            if expired:
+                logger.info(f"Expired challenges removed: {', '.join(expired)}")
+            await asyncio.to_thread(flush_challenges)
+        except Exception as e:
+            logger.error(f"Error during challenge maintenance: {str(e)}")
+
 def generate_battle_story(challenger: str, challenged: str) -> Dict[str, Any]:
     """Generate a dramatic battle story.
     
@@ -361,8 +419,11 @@ def determine_winner(challenger: str, challenged: str) -> Tuple[str, str]:
     challenger = challenger.replace('\n', ' ').replace('\r', ' ')
     challenged = challenged.replace('\n', ' ').replace('\r', ' ')
     
-    winner = random.choice([challenger, challenged])
-    loser = challenged if winner == challenger else challenger
+    # One random bit picks the winner without building a list per battle
+    if random.getrandbits(1):
+        winner, loser = challenger, challenged
+    else:
+        winner, loser = challenged, challenger
     
     logger.info(f"Battle result: {winner} defeated {loser}")
     return winner, loser
\ No newline at end of file
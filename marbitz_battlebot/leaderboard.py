@@ -5,98 +5,613 @@ This module handles leaderboard functionality including updating scores,
 formatting leaderboards for display, and managing weekly resets.
 """
 
+import asyncio
+import atexit
+import bisect
+import heapq
 import logging
+import threading
+import time
 from datetime import datetime
-from typing import Dict, Any, Tuple
+from functools import lru_cache
+from operator import itemgetter
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional, Tuple
 
 from marbitz_battlebot.storage import (
-    load_leaderboard, save_leaderboard, get_weekly_reset_info, 
-    save_weekly_reset_info, OVERALL_LEADERBOARD_FILE, WEEKLY_LEADERBOARD_FILE
+    load_leaderboard, append_battle_deltas, compact_leaderboard, journal_needs_compaction,
+    get_weekly_reset_info, save_weekly_reset_info, OVERALL_LEADERBOARD_FILE, WEEKLY_LEADERBOARD_FILE
 )
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
-def should_reset_weekly_leaderboard() -> bool:
+# Seconds to coalesce battle results before the write-behind flush
+FLUSH_INTERVAL = 5.0
+
+# Longest wait between retries while the leaderboard files cannot be written
+FLUSH_MAX_BACKOFF = 300.0
+
+# Translation table that drops Markdown markup for the plain-text fallbacks
+_MD_STRIP = str.maketrans('', '', '*_`')
+
+def strip_markdown(text: str) -> str:
+    """Remove Markdown markup characters in a single pass."""
+    return text.translate(_MD_STRIP)
+
+# Shared read-only stats for users who have not battled yet
+_DEFAULT_STATS: Mapping[str, int] = MappingProxyType({'wins': 0, 'losses': 0, 'marbles': 0})
+
+# Medals for the first three places; later places are numbered
+_MEDALS = ("🥇", "🥈", "🥉")
+
+# Display titles for each leaderboard file
+LEADERBOARD_TITLES = {
+    OVERALL_LEADERBOARD_FILE: "🏆 Overall Leaderboard",
+    WEEKLY_LEADERBOARD_FILE: "📅 Weekly Leaderboard",
+}
+
+def _summarize(stats: Any) -> Dict[str, Any]:
+    """Build a display row from one user's leaderboard entry.
+    
+    Args:
+        stats: The user's entry, or None if they have not battled
+        
+    Returns:
+        Dictionary with wins, losses, marbles, total and winrate_str
+    """
+    if not isinstance(stats, dict):
+        stats = {}
+    wins, losses, marbles = (
+        value if isinstance(value, int) else 0
+        for value in (stats.get('wins', 0), stats.get('losses', 0), stats.get('marbles', 0))
+    )
+    total = wins + losses
+    winrate = (wins / total * 100) if total > 0 else 0
+    return {
+        'wins': wins, 'losses': losses, 'marbles': marbles,
+        'total': total, 'winrate_str': f"{winrate:.1f}",
+    }
+
+# Shared read-only row for users who are not on a leaderboard
+_EMPTY_SUMMARY: Mapping[str, Any] = MappingProxyType(_summarize(None))
+
+def _clean_stats(username: Any, stats: Any) -> Optional[Dict[str, int]]:
+    """Validate one leaderboard entry for display.
+    
+    Args:
+        username: Username key from the leaderboard
+        stats: Stats stored for that user
+        
+    Returns:
+        Stats with every field present as an int, or None if the entry is
+        invalid or the user has not battled yet
+    """
+    # Skip entries with invalid usernames
+    if not username or not isinstance(username, str):
+        logger.warning("Skipping invalid username in leaderboard: %s", username)
+        return None
+        
+    # Skip entries with invalid stats
+    if not isinstance(stats, dict):
+        logger.warning("Skipping invalid stats for user %s: %s", username, stats)
+        return None
+        
+    # Ensure all required fields exist with valid values
+    valid_stats = {'wins': 0, 'losses': 0, 'marbles': 0}
+    for field in valid_stats:
+        if field in stats and isinstance(stats[field], (int, float)):
+            valid_stats[field] = int(stats[field])  # Convert to int to be safe
+        else:
+            logger.warning("Invalid or missing %s for user %s, using default", field, username)
+    
+    # Only include users who have participated in battles
+    if valid_stats['wins'] > 0 or valid_stats['losses'] > 0:
+        return valid_stats
+    return None
+
+def _rank_key(username: str, stats: Dict[str, int]) -> Optional[Tuple[int, float, int, str]]:
+    """Build the key that orders a user on the leaderboard, best first.
+    
+    Users are ranked by wins, then win rate, then marbles, with the username
+    as a final tiebreaker. The stats must come from a normalized leaderboard.
+    
+    Returns:
+        Sort key, or None if the user has not battled yet
+    """
+    wins, losses = stats['wins'], stats['losses']
+    if not wins and not losses:
+        return None
+    return (-wins, -(wins / max(1, wins + losses)), -stats['marbles'], username)
+
+class _Ranking:
+    """Users of one leaderboard kept in display order.
+    
+    Only the users touched by a battle are repositioned, so rendering never has
+    to sort the whole leaderboard.
+    """
+    
+    __slots__ = ('_keys', '_by_user')
+    
+    def __init__(self, leaderboard: Dict[str, Dict[str, int]]):
+        """Rank every user on the leaderboard once."""
+        self._by_user: Dict[str, Tuple[int, float, int, str]] = {}
+        for username, stats in leaderboard.items():
+            key = _rank_key(username, stats)
+            if key is not None:
+                self._by_user[username] = key
+        self._keys = sorted(self._by_user.values())
+    
+    def update(self, username: str, stats: Dict[str, int]) -> None:
+        """Move a user to their new position after their stats changed."""
+        old_key = self._by_user.pop(username, None)
+        if old_key is not None:
+            del self._keys[bisect.bisect_left(self._keys, old_key)]
+        new_key = _rank_key(username, stats)
+        if new_key is not None:
+            self._by_user[username] = new_key
+            bisect.insort(self._keys, new_key)
+    
+    def top(self, count: int = 10) -> List[str]:
+        """Get the usernames of the best ranked users."""
+        return [key[-1] for key in self._keys[:count]]
+
+class LeaderboardStore:
+    """In-memory leaderboards with write-behind persistence.
+    
+    The boards are parsed once and mutated in place. Battle results are queued
+    and appended to each board's journal by flush(), which the background flush
+    loop calls after each burst of battles; the full snapshot is only rewritten
+    when a journal outgrows it.
+    """
+    
+    def __init__(self):
+        """Initialize an empty store; boards are loaded from disk on first use."""
+        self._boards: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._rendered: Dict[str, Tuple[str, str]] = {}
+        self._derived: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._rankings: Dict[str, _Ranking] = {}
+        self._pending: Dict[str, List[Tuple[str, str, int, float]]] = {}
+        self._lock = threading.Lock()
+        # Serializes disk writes (journal appends, compaction and the weekly
+        # reset) so a reset can never interleave with a flush of last week's results
+        self._io_lock = threading.RLock()
+        self._dirty = asyncio.Event()
+        
+        # Bumped on every change so derived data can tell when it is stale
+        self.version = 0
+    
+    @property
+    def overall(self) -> Dict[str, Dict[str, int]]:
+        """The overall leaderboard."""
+        return self.get(OVERALL_LEADERBOARD_FILE)
+    
+    @property
+    def weekly(self) -> Dict[str, Dict[str, int]]:
+        """The weekly leaderboard."""
+        return self.get(WEEKLY_LEADERBOARD_FILE)
+    
+    def get_both(self) -> Tuple[Dict[str, Dict[str, int]], Dict[str, Dict[str, int]]]:
+        """Get the overall and weekly leaderboards together, loading them on first use."""
+        return self.get(OVERALL_LEADERBOARD_FILE), self.get(WEEKLY_LEADERBOARD_FILE)
+    
+    @property
+    def dirty(self) -> bool:
+        """Whether any leaderboard has changes that are not on disk yet."""
+        return bool(self._pending)
+    
+    def get(self, filename: str) -> Dict[str, Dict[str, int]]:
+        """Get a leaderboard, loading it from disk on first use.
+        
+        Args:
+            filename: Path to the leaderboard file
+        
+        Returns:
+            Dictionary containing the leaderboard data, including unflushed updates
+        """
+        board = self._boards.get(filename)
+        if board is None:
+            try:
+                board = load_leaderboard(filename)
+            except Exception as e:
+                logger.error("Error loading leaderboard %s: %s", filename, e)
+                board = None
+            if not isinstance(board, dict):
+                logger.error("Invalid leaderboard data in %s: %s", filename, type(board))
+                board = {}
+            board = self._boards.setdefault(filename, board)
+        return board
+    
+    def _ranking(self, filename: str) -> _Ranking:
+        """Get the display order of a leaderboard, ranking it on first use."""
+        ranking = self._rankings.get(filename)
+        if ranking is None:
+            ranking = self._rankings[filename] = _Ranking(self.get(filename))
+        return ranking
+    
+    def render(self, filename: str) -> Tuple[str, str]:
+        """Format a leaderboard and keep the result for later requests.
+        
+        Args:
+            filename: Path to the leaderboard file
+        
+        Returns:
+            Tuple containing the Markdown text and a plain-text fallback
+        """
+        text = format_leaderboard(self.get(filename), LEADERBOARD_TITLES.get(filename, "Leaderboard"),
+                                  top_users=self._ranking(filename).top(10))
+        rendered = (text, strip_markdown(text))
+        self._rendered[filename] = rendered
+        return rendered
+    
+    def is_rendered(self, filename: str) -> bool:
+        """Whether the leaderboard can be served without loading or formatting it."""
+        return filename in self._rendered
+
+    def get_rendered(self, filename: str) -> Tuple[str, str]:
+        """Get the formatted leaderboard, rendering it only if it was never rendered.
+        
+        Args:
+            filename: Path to the leaderboard file
+        
+        Returns:
+            Tuple containing the Markdown text and a plain-text fallback
+        """
+        rendered = self._rendered.get(filename)
+        if rendered is None:
+            rendered = self.render(filename)
+        return rendered
+    
+    def get_summary(self, filename: str, username: str) -> Mapping[str, Any]:
+        """Get a user's stats with the totals needed for display precomputed.
+        
+        Rows are only kept for users on the leaderboard, so looking up unknown
+        usernames cannot grow the store.
+        
+        Args:
+            filename: Path to the leaderboard file
+            username: Username without the @ prefix
+            
+        Returns:
+            Mapping with wins, losses, marbles, total and winrate_str
+        """
+        with self._lock:
+            rows = self._derived.setdefault(filename, {})
+            row = rows.get(username)
+            if row is None:
+                stats = self.get(filename).get(username)
+                if stats is None:
+                    return _EMPTY_SUMMARY
+                row = rows[username] = _summarize(stats)
+        return row
+    
+    def record_battle(self, winner: str, loser: str, marble_change: int) -> None:
+        """Apply one battle result to both leaderboards and schedule a flush.
+        
+        Args:
+            winner: Normalized username of the winner
+            loser: Normalized username of the loser
+            marble_change: Number of marbles wagered
+        
+        Raises:
+            RuntimeError: If the user statistics could not be updated
+        """
+        with self._lock:
+            overall, weekly = self.get_both()
+            rankings = [self._ranking(OVERALL_LEADERBOARD_FILE), self._ranking(WEEKLY_LEADERBOARD_FILE)]
+            _apply_battle_result(overall, weekly, winner, loser, marble_change)
+            delta = (winner, loser, marble_change, time.time())
+            for filename, board, ranking in ((OVERALL_LEADERBOARD_FILE, overall, rankings[0]),
+                                             (WEEKLY_LEADERBOARD_FILE, weekly, rankings[1])):
+                self._pending.setdefault(filename, []).append(delta)
+                ranking.update(winner, board[winner])
+                ranking.update(loser, board[loser])
+                rows = self._derived.setdefault(filename, {})
+                rows[winner] = _summarize(board[winner])
+                rows[loser] = _summarize(board[loser])
+                self.render(filename)
+            # Bumped last so nothing caches the old rows under the new version
+            self.version += 1
+        self._dirty.set()
+    
+    def reset_weekly(self) -> bool:
+        """Empty the weekly leaderboard on disk and in memory.
+        
+        The file is rewritten under the I/O lock only, so battles and stats
+        lookups on the event loop never wait on the disk. Results that were not
+        flushed before the new week is swapped in, including battles recorded
+        while the file was rewritten, count towards last week and are dropped
+        rather than journaled into the new week.
+        
+        Returns:
+            True if the weekly leaderboard was reset, False otherwise
+        """
+        with self._io_lock:
+            if not compact_leaderboard({}, WEEKLY_LEADERBOARD_FILE):
+                return False
+            
+            with self._lock:
+                self._boards[WEEKLY_LEADERBOARD_FILE] = {}
+                self._derived.pop(WEEKLY_LEADERBOARD_FILE, None)
+                self._rankings.pop(WEEKLY_LEADERBOARD_FILE, None)
+                self._pending.pop(WEEKLY_LEADERBOARD_FILE, None)
+                self.render(WEEKLY_LEADERBOARD_FILE)
+                self.version += 1
+        return True
+    
+    def _requeue(self, filename: str, deltas: List[Tuple[str, str, int, float]]) -> None:
+        """Put battle results that could not be written back in front of the queue."""
+        with self._lock:
+            self._pending.setdefault(filename, [])[:0] = deltas
+    
+    def flush(self) -> bool:
+        """Append pending battle results to the leaderboard journals.
+        
+        Journals that have outgrown their snapshot are compacted afterwards.
+        
+        Returns:
+            True if all pending results were written, False otherwise
+        """
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            
+            success = True
+            for filename, deltas in pending.items():
+                try:
+                    saved = append_battle_deltas(deltas, filename)
+                except Exception as e:
+                    logger.error("Error saving leaderboard %s: %s", filename, e)
+                    saved = False
+                if not saved:
+                    logger.error("Failed to flush leaderboard %s, will retry", filename)
+                    self._requeue(filename, deltas)
+                    success = False
+                elif journal_needs_compaction(filename):
+                    self.compact(filename)
+            return success
+    
+    def compact(self, filename: str) -> bool:
+        """Rewrite a leaderboard's snapshot from memory and empty its journal.
+        
+        Args:
+            filename: Path to the leaderboard file
+        
+        Returns:
+            True if the snapshot was saved, False otherwise
+        """
+        with self._io_lock:
+            with self._lock:
+                board = {user: dict(stats) for user, stats in self.get(filename).items()}
+                # Results still queued are part of the snapshot, so they must not be journaled too
+                deltas = self._pending.pop(filename, [])
+            
+            try:
+                saved = compact_leaderboard(board, filename)
+            except Exception as e:
+                logger.error("Error compacting leaderboard %s: %s", filename, e)
+                saved = False
+            if saved:
+                logger.info("Compacted leaderboard %s (%s entries)", filename, len(board))
+            else:
+                self._requeue(filename, deltas)
+            return saved
+    
+    async def periodic_flush(self, interval: float = FLUSH_INTERVAL) -> None:
+        """Flush updates in the background, coalescing bursts of battles.
+        
+        A failed flush is retried with an exponential backoff, capped at
+        FLUSH_MAX_BACKOFF, so a broken disk does not turn into a busy loop.
+        
+        Args:
+            interval: Seconds to wait after the first pending update before writing
+        """
+        failures = 0
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(interval)
+            self._dirty.clear()
+            if await asyncio.to_thread(self.flush):
+                failures = 0
+                continue
+            
+            # The failed results were requeued; make sure they are written eventually
+            failures += 1
+            self._dirty.set()
+            await asyncio.sleep(min(interval * 2 ** failures, FLUSH_MAX_BACKOFF))
+
+# Shared leaderboard store used by the bot
+store = LeaderboardStore()
+
+def get_leaderboard(filename: str = OVERALL_LEADERBOARD_FILE) -> Dict[str, Dict[str, int]]:
+    """Get the in-memory leaderboard, loading it from disk on first use.
+    
+    Args:
+        filename: Path to the leaderboard file
+    
+    Returns:
+        Dictionary containing the leaderboard data, including unflushed updates
+    """
+    return store.get(filename)
+
+def get_leaderboards() -> Tuple[Dict[str, Dict[str, int]], Dict[str, Dict[str, int]]]:
+    """Get the in-memory overall and weekly leaderboards in one call.
+    
+    Returns:
+        Tuple containing the overall and weekly leaderboards, including unflushed updates
+    """
+    return store.get_both()
+
+def get_rendered_leaderboard(filename: str) -> Tuple[str, str]:
+    """Get the formatted leaderboard, rendered when it last changed.
+    
+    Args:
+        filename: Path to the leaderboard file
+    
+    Returns:
+        Tuple containing the Markdown text and a plain-text fallback
+    """
+    return store.get_rendered(filename)
+
+def get_user_summary(username: str) -> Tuple[Mapping[str, Any], Mapping[str, Any]]:
+    """Get a user's precomputed overall and weekly stats rows.
+    
+    Args:
+        username: Username to get stats for
+        
+    Returns:
+        Tuple containing the overall and weekly rows (see LeaderboardStore.get_summary)
+        
+    Raises:
+        ValueError: If username is invalid
+    """
+    if not username:
+        logger.error("Empty username provided to get_user_summary")
+        raise ValueError("Username cannot be empty")
+    
+    if username.startswith('@'):
+        username = username[1:]
+    
+    return (store.get_summary(OVERALL_LEADERBOARD_FILE, username),
+            store.get_summary(WEEKLY_LEADERBOARD_FILE, username))
+
+def get_leaderboard_version() -> int:
+    """Get a counter that changes whenever either leaderboard changes.
+    
+    Returns:
+        Current leaderboard version
+    """
+    return store.version
+
+async def get_rendered_leaderboard_async(filename: str) -> Tuple[str, str]:
+    """Get the formatted leaderboard without blocking the event loop.
+    
+    The rendered text is returned directly when it is cached; only the first
+    request for a board that was never loaded reads the file, in a worker thread.
+    
+    Args:
+        filename: Path to the leaderboard file
+        
+    Returns:
+        Tuple containing the Markdown text and a plain-text fallback
+    """
+    if store.is_rendered(filename):
+        return store.get_rendered(filename)
+    return await asyncio.to_thread(store.get_rendered, filename)
+
+def preload_leaderboards() -> None:
+    """Load and render both leaderboards so no request has to read or format them."""
+    for filename in (OVERALL_LEADERBOARD_FILE, WEEKLY_LEADERBOARD_FILE):
+        board = store.get(filename)
+        store.render(filename)
+        logger.info("Loaded %s entries from %s", len(board), filename)
+
+def flush_leaderboards() -> bool:
+    """Write every leaderboard with pending updates to disk.
+    
+    Returns:
+        True if all pending leaderboards were saved, False otherwise
+    """
+    return store.flush()
+
+async def leaderboard_flush_loop(interval: float = FLUSH_INTERVAL) -> None:
+    """Flush leaderboard updates in the background, coalescing bursts of battles.
+    
+    Args:
+        interval: Seconds to wait after the first pending update before writing
+    """
+    await store.periodic_flush(interval)
+
+# Make sure buffered results reach disk even if the bot exits without a clean shutdown
+atexit.register(flush_leaderboards)
+
+# Valid reset_day values mapped to datetime.weekday() numbers
+_RESET_WEEKDAYS = {
+    day: number for number, day in
+    enumerate(('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'))
+}
+
+# The stored last_reset only changes once a week, so parse each value once
+_parse_last_reset = lru_cache(maxsize=8)(datetime.fromisoformat)
+
+def should_reset_weekly_leaderboard() -> Tuple[bool, Dict[str, Any]]:
     """Check if weekly leaderboard should be reset.
     
     Returns:
-        True if the leaderboard should be reset, False otherwise
+        Tuple of whether the leaderboard should be reset and the reset info the
+        decision was based on, so a reset can update it without reading it again
     """
+    reset_info = {}
     try:
-        # Get reset info with error handling
-        try:
-            reset_info = get_weekly_reset_info()
-            if reset_info is None:
-                logger.error("get_weekly_reset_info returned None")
-                reset_info = {}
-        except Exception as e:
-            logger.error(f"Error getting weekly reset info: {str(e)}")
-            reset_info = {}  # Use empty dict as fallback
-        
-        # Validate reset_info structure
-        if not isinstance(reset_info, dict):
-            logger.error(f"Invalid reset_info type: {type(reset_info)}")
-            reset_info = {}
+        # get_weekly_reset_info always returns a dict, falling back to the defaults on errors
+        reset_info = get_weekly_reset_info()
         
         # Get reset day with validation
         reset_day = reset_info.get('reset_day')
-        valid_days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        
-        if not reset_day or reset_day not in valid_days:
-            logger.warning(f"Invalid reset_day: {reset_day}, defaulting to Monday")
+        reset_weekday = _RESET_WEEKDAYS.get(reset_day)
+        if reset_weekday is None:
+            logger.warning("Invalid reset_day: %s, defaulting to Monday", reset_day)
             reset_day = 'Monday'
+            reset_weekday = 0
         
         # Get last reset with validation
         last_reset = reset_info.get('last_reset')
         if last_reset and not isinstance(last_reset, str):
-            logger.warning(f"Invalid last_reset type: {type(last_reset)}, treating as None")
+            logger.warning("Invalid last_reset type: %s, treating as None", type(last_reset))
             last_reset = None
         
         # Get current time
         now = datetime.now()
-        current_weekday = now.strftime('%A')
+        is_reset_day = now.weekday() == reset_weekday
+        
+        # Fast path for almost every battle: not the reset day and the last reset is recent
+        if last_reset and not is_reset_day:
+            try:
+                if (now - _parse_last_reset(last_reset)).days < 7:
+                    return False, reset_info
+            except (ValueError, TypeError):
+                pass  # Handled with logging below
         
         # If no previous reset, always reset on the reset day
-        if last_reset is None and current_weekday == reset_day:
-            logger.info(f"No previous reset and today is {reset_day}, should reset")
-            return True
+        if last_reset is None and is_reset_day:
+            logger.info("No previous reset and today is %s, should reset", reset_day)
+            return True, reset_info
         
         # If we have a last reset date
         if last_reset:
             try:
                 # Parse the last reset date
-                last_reset_date = datetime.fromisoformat(last_reset)
+                last_reset_date = _parse_last_reset(last_reset)
                 
                 # If it's the reset day and the last reset was not today
-                if current_weekday == reset_day and last_reset_date.date() != now.date():
+                if is_reset_day and last_reset_date.date() != now.date():
                     # Check if the last reset was at least 6 days ago
                     days_since_reset = (now - last_reset_date).days
                     if days_since_reset >= 6:
-                        logger.info(f"Today is {reset_day} and last reset was {days_since_reset} days ago, should reset")
-                        return True
+                        logger.info("Today is %s and last reset was %s days ago, should reset", reset_day, days_since_reset)
+                        return True, reset_info
                     else:
-                        logger.info(f"Today is {reset_day} but last reset was only {days_since_reset} days ago, not resetting yet")
+                        logger.info("Today is %s but last reset was only %s days ago, not resetting yet", reset_day, days_since_reset)
                 
                 # If it's been more than 7 days since the last reset (failsafe)
                 if (now - last_reset_date).days >= 7:
-                    logger.info(f"It's been {(now - last_reset_date).days} days since last reset, should reset (failsafe)")
-                    return True
+                    logger.info("It's been %s days since last reset, should reset (failsafe)", (now - last_reset_date).days)
+                    return True, reset_info
                     
             except (ValueError, TypeError) as e:
-                logger.error(f"Error parsing last reset date '{last_reset}': {str(e)}")
+                logger.error("Error parsing last reset date '%s': %s", last_reset, e)
                 # Reset on the reset day if we can't parse the date
-                if current_weekday == reset_day:
-                    logger.info(f"Could not parse last reset date and today is {reset_day}, should reset")
-                    return True
+                if is_reset_day:
+                    logger.info("Could not parse last reset date and today is %s, should reset", reset_day)
+                    return True, reset_info
         
-        logger.info(f"No reset needed. Today: {current_weekday}, Reset day: {reset_day}, Last reset: {last_reset}")
-        return False
+        logger.info("No reset needed. Today: %s, Reset day: %s, Last reset: %s", now.strftime('%A'), reset_day, last_reset)
+        return False, reset_info
         
     except Exception as e:
-        logger.error(f"Unexpected error in should_reset_weekly_leaderboard: {str(e)}")
+        logger.error("Unexpected error in should_reset_weekly_leaderboard: %s", e)
         # Default to not resetting in case of unexpected errors
-        return False
+        return False, reset_info
 
 def reset_weekly_leaderboard() -> bool:
     """Reset the weekly leaderboard.
@@ -105,76 +620,51 @@ def reset_weekly_leaderboard() -> bool:
         True if the leaderboard was reset, False otherwise
     """
     try:
-        # Check if reset is needed
-        should_reset = False
-        try:
-            should_reset = should_reset_weekly_leaderboard()
-        except Exception as e:
-            logger.error(f"Error checking if weekly leaderboard should be reset: {str(e)}")
-            # Default to not resetting in case of errors
-            return False
-        
-        if not should_reset:
-            logger.debug("Weekly leaderboard reset not needed")
-            return False
+        # Check and reset under the store's write lock, so concurrent callers
+        # reset at most once and a flush cannot run in between
+        with store._io_lock:
+            # should_reset_weekly_leaderboard does not raise; it answers False on errors
+            should_reset, reset_info = should_reset_weekly_leaderboard()
+            if not should_reset:
+                logger.debug("Weekly leaderboard reset not needed")
+                return False
+                
+            logger.info("Resetting weekly leaderboard...")
             
-        logger.info("Resetting weekly leaderboard...")
-        
-        # Clear weekly leaderboard with error handling
-        try:
-            if not save_leaderboard({}, WEEKLY_LEADERBOARD_FILE):
+            # Clear weekly leaderboard on disk and in memory
+            if not store.reset_weekly():
                 logger.error("Failed to save empty weekly leaderboard")
                 return False
-        except Exception as e:
-            logger.error(f"Error saving empty weekly leaderboard: {str(e)}")
-            return False
-        
-        # Update reset info with error handling
-        try:
-            reset_info = get_weekly_reset_info()
-            if reset_info is None:
-                logger.error("get_weekly_reset_info returned None")
-                reset_info = {}
-                
-            # Validate reset_info structure
-            if not isinstance(reset_info, dict):
-                logger.error(f"Invalid reset_info type: {type(reset_info)}")
-                reset_info = {}
-                
-            # Update last reset timestamp
-            reset_info['last_reset'] = datetime.now().isoformat()
             
-            # Ensure reset_day is set
-            if 'reset_day' not in reset_info or not reset_info['reset_day']:
+            # Update last reset timestamp, making sure reset_day is set
+            reset_info['last_reset'] = datetime.now().isoformat()
+            if not reset_info.get('reset_day'):
                 reset_info['reset_day'] = 'Monday'
                 
-            # Save updated reset info
             if not save_weekly_reset_info(reset_info):
                 logger.error("Failed to save weekly reset info")
                 return False
-                
-        except Exception as e:
-            logger.error(f"Error updating weekly reset info: {str(e)}")
-            return False
         
         logger.info("Weekly leaderboard has been reset successfully.")
         return True
         
     except Exception as e:
-        logger.error(f"Unexpected error in reset_weekly_leaderboard: {str(e)}")
+        logger.error("Unexpected error in reset_weekly_leaderboard: %s", e)
         return False
 
-def update_leaderboard(winner: str, loser: str, marble_change: int = 0) -> None:
-    """Update both overall and weekly leaderboards.
+def _validate_battle(winner: str, loser: str, marble_change: Any) -> Tuple[str, str, int]:
+    """Validate and normalize the arguments of a leaderboard update.
     
     Args:
         winner: Username of the winner
         loser: Username of the loser
         marble_change: Number of marbles wagered
         
+    Returns:
+        Tuple containing the winner and loser without @ prefix and the marble change
+        
     Raises:
-        ValueError: If usernames are invalid or marble_change is negative
-        RuntimeError: If there's an error updating the leaderboard
+        ValueError: If usernames are invalid
     """
     # Validate inputs
     if not winner:
@@ -195,120 +685,127 @@ def update_leaderboard(winner: str, loser: str, marble_change: int = 0) -> None:
     try:
         marble_change = int(marble_change)
         if marble_change < 0:
-            logger.warning(f"Negative marble_change provided: {marble_change}, using absolute value")
+            logger.warning("Negative marble_change provided: %s, using absolute value", marble_change)
             marble_change = abs(marble_change)
     except (ValueError, TypeError):
-        logger.warning(f"Invalid marble_change value: {marble_change}, defaulting to 0")
+        logger.warning("Invalid marble_change value: %s, defaulting to 0", marble_change)
         marble_change = 0
     
-    # Reset weekly leaderboard if needed
+    return winner, loser, marble_change
+
+def _record_battle(winner: str, loser: str, marble_change: int) -> None:
+    """Record a validated battle result in the store.
+    
+    Args:
+        winner: Normalized username of the winner
+        loser: Normalized username of the loser
+        marble_change: Number of marbles wagered
+        
+    Raises:
+        RuntimeError: If there's an error updating the leaderboard
+    """
     try:
-        if reset_weekly_leaderboard():
-            logger.info("Weekly leaderboard was reset before updating")
+        store.record_battle(winner, loser, marble_change)
     except Exception as e:
-        logger.error(f"Error during weekly leaderboard reset check: {str(e)}")
-        # Continue with the update even if reset check fails
+        logger.error("Error updating leaderboard: %s", e)
+        raise RuntimeError(f"Failed to update leaderboard: {str(e)}")
+    
+    logger.info("Leaderboard updated: %s won against %s with %s marbles", winner, loser, marble_change)
+
+def update_leaderboard(winner: str, loser: str, marble_change: int = 0) -> None:
+    """Update both overall and weekly leaderboards.
+    
+    The in-memory leaderboards are updated and re-rendered immediately; writing
+    them to disk is left to leaderboard_flush_loop (or flush_leaderboards at shutdown).
+    Call this from the event loop thread; handlers use update_leaderboard_async.
     
+    Args:
+        winner: Username of the winner
+        loser: Username of the loser
+        marble_change: Number of marbles wagered
+        
+    Raises:
+        ValueError: If usernames are invalid or marble_change is negative
+        RuntimeError: If there's an error updating the leaderboard
+    """
+    winner, loser, marble_change = _validate_battle(winner, loser, marble_change)
+    
+    # Reset weekly leaderboard if needed (never raises; a failed check skips the reset)
+    if reset_weekly_leaderboard():
+        logger.info("Weekly leaderboard was reset before updating")
+    
+    _record_battle(winner, loser, marble_change)
+
+async def update_leaderboard_async(winner: str, loser: str, marble_change: int = 0) -> None:
+    """Update both leaderboards without blocking the event loop.
+    
+    Only a due weekly reset, which writes and fsyncs files, runs in a worker
+    thread; the result itself is recorded on the event loop thread, which owns
+    the store's flush event.
+    
+    Args:
+        winner: Username of the winner
+        loser: Username of the loser
+        marble_change: Number of marbles wagered
+        
+    Raises:
+        ValueError: If usernames are invalid or marble_change is negative
+        RuntimeError: If there's an error updating the leaderboard
+    """
+    winner, loser, marble_change = _validate_battle(winner, loser, marble_change)
+    
+    # The cheap check avoids a thread hop on every battle; reset_weekly_leaderboard
+    # checks again under the store's lock, so concurrent battles reset only once
+    if should_reset_weekly_leaderboard()[0]:
+        if await asyncio.to_thread(reset_weekly_leaderboard):
+            logger.info("Weekly leaderboard was reset before updating")
+    
+    _record_battle(winner, loser, marble_change)
+
+def _apply_battle_result(overall: Dict[str, Dict[str, int]], weekly: Dict[str, Dict[str, int]],
+                         winner: str, loser: str, marble_change: int) -> None:
+    """Apply one battle result to the overall and weekly leaderboards in place.
+    
+    Args:
+        overall: Overall leaderboard to update
+        weekly: Weekly leaderboard to update
+        winner: Normalized username of the winner
+        loser: Normalized username of the loser
+        marble_change: Number of marbles wagered
+        
+    Raises:
+        RuntimeError: If the user statistics could not be updated
+    """
     try:
-        # Load leaderboards with error handling
-        try:
-            overall = load_leaderboard(OVERALL_LEADERBOARD_FILE)
-            if overall is None:
-                logger.error("load_leaderboard returned None for overall leaderboard")
-                overall = {}
-        except Exception as e:
-            logger.error(f"Error loading overall leaderboard: {str(e)}")
-            overall = {}  # Use empty dict as fallback
-            
-        try:
-            weekly = load_leaderboard(WEEKLY_LEADERBOARD_FILE)
-            if weekly is None:
-                logger.error("load_leaderboard returned None for weekly leaderboard")
-                weekly = {}
-        except Exception as e:
-            logger.error(f"Error loading weekly leaderboard: {str(e)}")
-            weekly = {}  # Use empty dict as fallback
-        
-        # Validate leaderboard data structures
-        if not isinstance(overall, dict):
-            logger.error(f"Invalid overall leaderboard type: {type(overall)}")
-            overall = {}
-            
-        if not isinstance(weekly, dict):
-            logger.error(f"Invalid weekly leaderboard type: {type(weekly)}")
-            weekly = {}
-        
-        # Initialize user stats if they don't exist
-        for leaderboard in [overall, weekly]:
-            for user in [winner, loser]:
-                if user not in leaderboard:
-                    leaderboard[user] = {'wins': 0, 'losses': 0, 'marbles': 0}
-                else:
-                    # Validate existing user stats
-                    required_fields = ['wins', 'losses', 'marbles']
-                    for field in required_fields:
-                        if field not in leaderboard[user]:
-                            logger.warning(f"Missing {field} in {user}'s stats, initializing to 0")
-                            leaderboard[user][field] = 0
-                        elif not isinstance(leaderboard[user][field], int):
-                            logger.warning(f"Invalid {field} type for {user}: {type(leaderboard[user][field])}, resetting to 0")
-                            leaderboard[user][field] = 0
-        
-        # Update stats
-        try:
-            overall[winner]['wins'] += 1
-            overall[loser]['losses'] += 1
-            weekly[winner]['wins'] += 1
-            weekly[loser]['losses'] += 1
+        for leaderboard in (overall, weekly):
+            # Initialize user stats if they don't exist; loaded boards are already normalized
+            winner_stats = leaderboard.setdefault(winner, {'wins': 0, 'losses': 0, 'marbles': 0})
+            loser_stats = leaderboard.setdefault(loser, {'wins': 0, 'losses': 0, 'marbles': 0})
             
-            # Update marble counts
-            overall[winner]['marbles'] += marble_change
-            overall[loser]['marbles'] -= marble_change
-            weekly[winner]['marbles'] += marble_change
-            weekly[loser]['marbles'] -= marble_change
-        except Exception as e:
-            logger.error(f"Error updating user stats: {str(e)}")
-            raise RuntimeError(f"Failed to update user statistics: {str(e)}")
-        
-        # Save updated leaderboards
-        save_success = True
-        try:
-            if not save_leaderboard(overall, OVERALL_LEADERBOARD_FILE):
-                logger.error("Failed to save overall leaderboard")
-                save_success = False
-        except Exception as e:
-            logger.error(f"Error saving overall leaderboard: {str(e)}")
-            save_success = False
-            
-        try:
-            if not save_leaderboard(weekly, WEEKLY_LEADERBOARD_FILE):
-                logger.error("Failed to save weekly leaderboard")
-                save_success = False
-        except Exception as e:
-            logger.error(f"Error saving weekly leaderboard: {str(e)}")
-            save_success = False
-            
-        if not save_success:
-            raise RuntimeError("Failed to save leaderboard updates")
-        
-        logger.info(f"Leaderboard updated: {winner} won against {loser} with {marble_change} marbles")
+            winner_stats['wins'] += 1
+            winner_stats['marbles'] += marble_change
+            loser_stats['losses'] += 1
+            loser_stats['marbles'] -= marble_change
     except Exception as e:
-        logger.error(f"Error updating leaderboard: {str(e)}")
-        raise RuntimeError(f"Failed to update leaderboard: {str(e)}")
+        logger.error("Error updating user stats: %s", e)
+        raise RuntimeError(f"Failed to update user statistics: {str(e)}")
 
-def format_leaderboard(leaderboard: Dict[str, Dict[str, int]], title: str) -> str:
+def format_leaderboard(leaderboard: Dict[str, Dict[str, int]], title: str,
+                       top_users: Optional[List[str]] = None) -> str:
     """Format leaderboard for display.
     
     Args:
         leaderboard: Dictionary containing leaderboard data
         title: Title for the leaderboard
+        top_users: Usernames to show, already in display order; the leaderboard
+            is validated and sorted here when they are not given
         
     Returns:
         Formatted leaderboard text
     """
     # Validate inputs
     if title is None or not isinstance(title, str):
-        logger.warning(f"Invalid title provided to format_leaderboard: {title}")
+        logger.warning("Invalid title provided to format_leaderboard: %s", title)
         title = "Leaderboard"  # Use default title
     
     # Handle empty leaderboard
@@ -317,121 +814,66 @@ def format_leaderboard(leaderboard: Dict[str, Dict[str, int]], title: str) -> st
     
     # Validate leaderboard type
     if not isinstance(leaderboard, dict):
-        logger.error(f"Invalid leaderboard type: {type(leaderboard)}")
+        logger.error("Invalid leaderboard type: %s", type(leaderboard))
         return f"**{title}**\n\nError: Invalid leaderboard data format."
     
     try:
-        # Validate and clean leaderboard data
-        valid_entries = {}
-        default_stats = {'wins': 0, 'losses': 0, 'marbles': 0}
-        
-        for username, stats in leaderboard.items():
-            # Skip entries with invalid usernames
-            if not username or not isinstance(username, str):
-                logger.warning(f"Skipping invalid username in leaderboard: {username}")
-                continue
-                
-            # Skip entries with invalid stats
-            if not isinstance(stats, dict):
-                logger.warning(f"Skipping invalid stats for user {username}: {stats}")
-                continue
-                
-            # Ensure all required fields exist with valid values
-            valid_stats = default_stats.copy()
-            for field in default_stats:
-                if field in stats and isinstance(stats[field], (int, float)):
-                    valid_stats[field] = int(stats[field])  # Convert to int to be safe
-                else:
-                    logger.warning(f"Invalid or missing {field} for user {username}, using default")
+        if top_users is not None:
+            # Already ranked by the leaderboard store, which only holds validated boards
+            display_users = [(user, leaderboard[user]) for user in top_users[:10]]
+        else:
+            # Validate and clean leaderboard data, building each user's sort key once:
+            # wins (primary), win rate (secondary), and marbles (tertiary)
+            valid_entries = []
+            for username, stats in leaderboard.items():
+                valid_stats = _clean_stats(username, stats)
+                if valid_stats is not None:
+                    wins, losses = valid_stats['wins'], valid_stats['losses']
+                    key = (-wins, -(wins / max(1, wins + losses)), -valid_stats['marbles'])
+                    valid_entries.append((key, username, valid_stats))
             
-            # Only include users who have participated in battles
-            if valid_stats['wins'] > 0 or valid_stats['losses'] > 0:
-                valid_entries[username] = valid_stats
+            # Top 10 selected with a bounded heap instead of sorting every user
+            display_users = [
+                (username, stats)
+                for _, username, stats in heapq.nsmallest(10, valid_entries, key=itemgetter(0))
+            ]
         
         # If no valid entries after cleaning
-        if not valid_entries:
+        if not display_users:
             return f"**{title}**\n\nNo valid battle records found! 🏆"
         
-        # Sort by wins (primary), win rate (secondary), and marbles (tertiary)
-        try:
-            sorted_users = sorted(
-                valid_entries.items(),
-                key=lambda x: (
-                    x[1]['wins'],  # Primary sort by wins
-                    x[1]['wins'] / max(1, x[1]['wins'] + x[1]['losses']),  # Secondary sort by win rate
-                    x[1]['marbles']  # Tertiary sort by marbles (as a tiebreaker)
-                ),
-                reverse=True
-            )
-        except Exception as e:
-            logger.error(f"Error sorting leaderboard: {str(e)}")
-            # Fallback to simpler sorting if complex sort fails
-            sorted_users = sorted(
-                valid_entries.items(),
-                key=lambda x: x[1]['wins'],
-                reverse=True
-            )
-        
-        # Format the leaderboard text
-        text = f"**{title}**\n\n"
-        
-        # Limit to top 10 users
-        display_users = sorted_users[:10] if len(sorted_users) > 10 else sorted_users
-        
-        for i, (user, stats) in enumerate(display_users, 1):
-            try:
-                wins = stats['wins']
-                losses = stats['losses']
-                marbles = stats['marbles']
-                total_battles = wins + losses
-                
-                # Calculate win rate safely
-                try:
-                    win_rate = (wins / total_battles * 100) if total_battles > 0 else 0
-                except (ZeroDivisionError, TypeError):
-                    win_rate = 0
-                
-                # Format display with error handling
-                try:
-                    medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"{i}."
-                    
-                    # Ensure username has @ prefix for display
-                    display_username = user
-                    if not display_username.startswith('@'):
-                        display_username = f"@{display_username}"
-                    
-                    # Format the line with error handling for each part
-                    line_parts = []
-                    line_parts.append(f"{medal} {display_username}")
-                    line_parts.append(f"{wins}W-{losses}L")
-                    line_parts.append(f"({win_rate:.1f}%)")
-                    line_parts.append(f"{marbles:+d} marbles")
-                    
-                    text += " | ".join(line_parts) + "\n"
-                except Exception as e:
-                    logger.error(f"Error formatting line for user {user}: {str(e)}")
-                    text += f"{i}. @{user}: Error displaying stats\n"
-            except Exception as e:
-                logger.error(f"Error processing stats for user {user}: {str(e)}")
-                text += f"{i}. @{user}: Error processing stats\n"
-        
-        return text
+        # Format the leaderboard text in one join; stats are ints at this point
+        # (validated above or on load), so the lines cannot fail
+        lines = [f"**{title}**", ""]
+        for i, (user, stats) in enumerate(display_users):
+            wins = stats['wins']
+            losses = stats['losses']
+            total_battles = wins + losses
+            win_rate = (wins / total_battles * 100) if total_battles > 0 else 0
+            medal = _MEDALS[i] if i < 3 else f"{i + 1}."
+            
+            # Ensure username has @ prefix for display
+            display_username = user if user.startswith('@') else f"@{user}"
+            
+            lines.append(f"{medal} {display_username} | {wins}W-{losses}L | ({win_rate:.1f}%) | {stats['marbles']:+d} marbles")
+        lines.append("")
+        return "\n".join(lines)
     except Exception as e:
-        logger.error(f"Error formatting leaderboard: {str(e)}")
+        logger.error("Error formatting leaderboard: %s", e)
         return f"**{title}**\n\nError formatting leaderboard. Please try again later."
 
-def get_user_stats(username: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+def get_user_stats(username: str) -> Tuple[Mapping[str, int], Mapping[str, int]]:
     """Get a user's stats from both overall and weekly leaderboards.
     
     Args:
         username: Username to get stats for
         
     Returns:
-        Tuple containing overall and weekly stats
+        Tuple containing overall and weekly stats; these are the live leaderboard
+        entries (or a shared read-only default), so copy them before making changes
         
     Raises:
         ValueError: If username is invalid
-        RuntimeError: If there's an error loading the leaderboards
     """
     # Validate username
     if not username:
@@ -442,62 +884,8 @@ def get_user_stats(username: str) -> Tuple[Dict[str, int], Dict[str, int]]:
     if username.startswith('@'):
         username = username[1:]
     
-    # Default stats structure
-    default_stats = {'wins': 0, 'losses': 0, 'marbles': 0}
+    # Boards in the store are validated when loaded, so the entries can be returned as-is
+    overall, weekly = get_leaderboards()
     
-    try:
-        # Load overall leaderboard
-        try:
-            overall = load_leaderboard(OVERALL_LEADERBOARD_FILE)
-            if overall is None:
-                logger.error("load_leaderboard returned None for overall leaderboard")
-                overall = {}
-        except Exception as e:
-            logger.error(f"Error loading overall leaderboard: {str(e)}")
-            overall = {}  # Use empty dict as fallback
-        
-        # Load weekly leaderboard
-        try:
-            weekly = load_leaderboard(WEEKLY_LEADERBOARD_FILE)
-            if weekly is None:
-                logger.error("load_leaderboard returned None for weekly leaderboard")
-                weekly = {}
-        except Exception as e:
-            logger.error(f"Error loading weekly leaderboard: {str(e)}")
-            weekly = {}  # Use empty dict as fallback
-        
-        # Validate leaderboard data structures
-        if not isinstance(overall, dict):
-            logger.error(f"Invalid overall leaderboard type: {type(overall)}")
-            overall = {}
-            
-        if not isinstance(weekly, dict):
-            logger.error(f"Invalid weekly leaderboard type: {type(weekly)}")
-            weekly = {}
-        
-        # Get user stats with validation
-        overall_stats = overall.get(username, default_stats.copy())
-        weekly_stats = weekly.get(username, default_stats.copy())
-        
-        # Validate stats structure
-        for stats, board_name in [(overall_stats, "overall"), (weekly_stats, "weekly")]:
-            if not isinstance(stats, dict):
-                logger.error(f"Invalid {board_name} stats type for {username}: {type(stats)}")
-                stats = default_stats.copy()
-                
-            # Ensure all required fields exist
-            for field in default_stats:
-                if field not in stats:
-                    logger.warning(f"Missing {field} in {username}'s {board_name} stats, initializing to 0")
-                    stats[field] = 0
-                elif not isinstance(stats[field], int):
-                    logger.warning(f"Invalid {field} type in {username}'s {board_name} stats: {type(stats[field])}, resetting to 0")
-                    stats[field] = 0
-        
-        logger.info(f"Retrieved stats for user {username}")
-        return overall_stats, weekly_stats
-        
-    except Exception as e:
-        logger.error(f"Error getting user stats for {username}: {str(e)}")
-        # Return default stats as fallback
-        return default_stats.copy(), default_stats.copy()
\ No newline at end of file
+    logger.info("Retrieved stats for user %s", username)
+    return overall.get(username, _DEFAULT_STATS), weekly.get(username, _DEFAULT_STATS)
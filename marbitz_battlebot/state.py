@@ -5,10 +5,14 @@ This module provides a class-based approach to manage application state,
 including active challenges and challenge counters.
 """
 
+import heapq
 import logging
 import threading
+from functools import lru_cache
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Tuple
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional, Tuple
 
 from marbitz_battlebot.storage import (
     load_json_file, save_json_file, CHALLENGES_FILE
@@ -17,19 +21,119 @@ from marbitz_battlebot.storage import (
 # Enable logging
 logger = logging.getLogger(__name__)
 
+# Allowed values for a challenge's status field
+VALID_STATUSES = frozenset({'pending', 'accepted', 'declined', 'completed', 'expired'})
+
+@lru_cache(maxsize=4096)
+def normalize_username(username: str) -> str:
+    """Normalize a username for comparisons and lookups (casefolded, no @ prefix)."""
+    return username.strip().lstrip('@').casefold()
+
+@lru_cache(maxsize=4096)
+def at(name: str) -> str:
+    """Format a username for display, with exactly one leading @."""
+    return name if name.startswith('@') else '@' + name
+
+def strip_at(name: str) -> str:
+    """Remove a leading @ from a username, keeping its case."""
+    return name[1:] if name.startswith('@') else name
+
+@dataclass(slots=True)
+class Challenge:
+    """
+    An active challenge between two users.
+    
+    The lowercase usernames are derived once at construction (and refreshed by
+    ChallengeManager.update_challenge) so comparisons never re-normalize.
+    """
+    
+    challenger: str
+    challenged: str
+    wager_amount: int = 0
+    created_at: datetime = field(default_factory=datetime.now)
+    status: str = 'pending'
+    challenger_lower: str = ''
+    challenged_lower: str = ''
+    
+    def __post_init__(self) -> None:
+        if not self.challenger_lower or not self.challenged_lower:
+            self.refresh_usernames()
+    
+    def refresh_usernames(self) -> None:
+        """Recompute the lowercase usernames after a username changes."""
+        self.challenger_lower = normalize_username(self.challenger)
+        self.challenged_lower = normalize_username(self.challenged)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert the challenge to its JSON storage format.
+        
+        Returns:
+            Dictionary with the persisted challenge fields
+        """
+        return {
+            'challenger_user': self.challenger,
+            'challenged_user': self.challenged,
+            'wager_amount': self.wager_amount,
+            'timestamp': self.created_at.isoformat(),
+            'status': self.status,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Challenge':
+        """
+        Build a challenge from its JSON storage format.
+        
+        Args:
+            data: Dictionary as produced by to_dict
+            
+        Returns:
+            The challenge
+            
+        Raises:
+            ValueError: If required fields are missing or invalid
+        """
+        if not isinstance(data, dict):
+            raise ValueError(f"Challenge data must be a dictionary, got {type(data)}")
+        challenger = data.get('challenger_user')
+        challenged = data.get('challenged_user')
+        if not challenger or not challenged:
+            raise ValueError("Challenge is missing challenger or challenged username")
+        try:
+            created_at = datetime.fromisoformat(data['timestamp'])
+            wager_amount = max(int(data.get('wager_amount', 0)), 0)
+        except (KeyError, ValueError, TypeError) as e:
+            raise ValueError(f"Invalid challenge data: {e}") from e
+        status = data.get('status', 'pending')
+        if status not in VALID_STATUSES:
+            status = 'pending'
+        return cls(challenger, challenged, wager_amount, created_at, status)
+
 class ChallengeManager:
     """
     Manages the state of active challenges in the application.
     
     This class provides thread-safe access to challenge data and ensures
     that challenges are properly persisted to storage.
+    
+    Every mutation holds the lock, and dicts are only ever replaced or changed by
+    single operations. Reads that are a single dict operation (a lookup, len or
+    copy) are atomic under the GIL, so they skip the lock and never wait on
+    writers; reads that combine several structures still take it.
     """
     
     _instance = None
     _lock = threading.RLock()
     
+    # Challenge fields that update_challenge may change
+    _UPDATABLE_FIELDS = frozenset({'challenger', 'challenged', 'wager_amount', 'status'})
+    
     def __new__(cls):
         """Implement singleton pattern to ensure only one instance exists."""
+        # Once created, the instance is returned without taking the lock
+        instance = cls._instance
+        if instance is not None:
+            return instance
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super(ChallengeManager, cls).__new__(cls)
@@ -44,44 +148,120 @@ class ChallengeManager:
             
         with self._lock:
             self._active_challenges = {}
+            self._by_challenger = {}  # normalized challenger username -> challenge ID
+            self._by_challenged = {}  # normalized challenged username -> set of challenge IDs
+            self._expiry_heap = []  # (created_at, challenge ID), oldest first; may hold removed IDs
             self._challenge_counter = 0
+            self._dirty = False  # True while in-memory changes haven't been written to disk
+            self._loaded = False  # Stored challenges are read on first use
             self._initialized = True
-            self._load_state()
+    
+    def _ensure_loaded(self) -> None:
+        """Load the stored challenges the first time they are needed."""
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load_state()
+                self._loaded = True
+    
+    _normalize_username = staticmethod(normalize_username)
+    
+    def _rebuild_index(self) -> None:
+        """Rebuild the username indexes from the active challenges."""
+        # Build the new indexes aside so lock-free readers never see a partial one
+        by_challenger = {}
+        by_challenged = {}
+        for challenge_id, challenge in self._active_challenges.items():
+            by_challenger.setdefault(challenge.challenger_lower, challenge_id)
+            by_challenged.setdefault(challenge.challenged_lower, set()).add(challenge_id)
+        self._by_challenger = by_challenger
+        self._by_challenged = by_challenged
+    
+    def _unindex_challenge(self, challenge_id: str, challenge: Challenge) -> None:
+        """Drop a challenge from the username indexes."""
+        if self._by_challenger.get(challenge.challenger_lower) == challenge_id:
+            del self._by_challenger[challenge.challenger_lower]
+        challenge_ids = self._by_challenged.get(challenge.challenged_lower)
+        if challenge_ids is not None:
+            challenge_ids.discard(challenge_id)
+            if not challenge_ids:
+                del self._by_challenged[challenge.challenged_lower]
     
     def _load_state(self) -> None:
         """Load challenge state from storage."""
         try:
-            self._active_challenges = load_json_file(CHALLENGES_FILE)
+            stored = load_json_file(CHALLENGES_FILE)
+            
+            self._active_challenges = {}
+            for challenge_id, data in stored.items():
+                try:
+                    self._active_challenges[challenge_id] = Challenge.from_dict(data)
+                except ValueError as e:
+                    logger.warning("Dropping invalid stored challenge %s: %s", challenge_id, e)
             
             # Calculate the highest challenge counter
-            challenge_ids = [k for k in self._active_challenges.keys() if k.startswith('challenge_')]
+            challenge_ids = [k for k in stored.keys() if k.startswith('challenge_')]
             if challenge_ids:
                 counters = [int(cid.split('_')[1]) for cid in challenge_ids if cid.split('_')[1].isdigit()]
                 self._challenge_counter = max(counters, default=0)
+            
+            self._rebuild_index()
+            self._expiry_heap = [(challenge.created_at, challenge_id)
+                                 for challenge_id, challenge in self._active_challenges.items()]
+            heapq.heapify(self._expiry_heap)
                 
-            logger.info(f"Loaded {len(self._active_challenges)} active challenges. Challenge counter: {self._challenge_counter}")
+            logger.info("Loaded %s active challenges. Challenge counter: %s", len(self._active_challenges), self._challenge_counter)
         except Exception as e:
-            logger.error(f"Error loading challenge state: {e}")
+            logger.error("Error loading challenge state: %s", e)
             self._active_challenges = {}
+            self._by_challenger = {}
+            self._by_challenged = {}
+            self._expiry_heap = []
             self._challenge_counter = 0
     
-    def _save_state(self) -> bool:
+    def _save_state(self, challenges: Dict[str, Dict[str, Any]]) -> bool:
         """
         Save challenge state to storage.
         
+        Args:
+            challenges: Snapshot of the active challenges to write
+            
         Returns:
             True if save was successful, False otherwise
         """
         try:
-            success = save_json_file(self._active_challenges, CHALLENGES_FILE)
+            success = save_json_file(challenges, CHALLENGES_FILE)
             if success:
-                logger.info(f"Saved {len(self._active_challenges)} active challenges")
+                logger.info("Saved %s active challenges", len(challenges))
             else:
                 logger.error("Failed to save challenge state")
             return success
         except Exception as e:
-            logger.error(f"Error saving challenge state: {e}")
+            logger.error("Error saving challenge state: %s", e)
+            return False
+    
+    def flush(self) -> bool:
+        """
+        Write the active challenges to storage if they changed since the last flush.
+        
+        Challenges live in memory and are only persisted here, from the periodic
+        maintenance task and at shutdown, so handlers never wait on disk I/O.
+        
+        Returns:
+            True if the state on disk is up to date, False if the save failed
+        """
+        with self._lock:
+            if not self._dirty:
+                return True
+            snapshot = {cid: challenge.to_dict() for cid, challenge in self._active_challenges.items()}
+            self._dirty = False
+        
+        if not self._save_state(snapshot):
+            with self._lock:
+                self._dirty = True
             return False
+        return True
     
     def create_challenge(self, challenger: str, challenged: str, wager_amount: int = 0) -> str:
         """
@@ -98,6 +278,7 @@ class ChallengeManager:
         Raises:
             ValueError: If input parameters are invalid
         """
+        self._ensure_loaded()
         # Validate inputs
         if not challenger:
             logger.error("Empty challenger username provided")
@@ -107,45 +288,47 @@ class ChallengeManager:
             logger.error("Empty challenged username provided")
             raise ValueError("Challenged username cannot be empty")
             
-        if challenger.lower() == challenged.lower():
-            logger.error(f"User {challenger} attempted to challenge themselves")
+        # Normalize once; the keys are reused for the self-check and the index
+        challenger_key = self._normalize_username(challenger)
+        challenged_key = self._normalize_username(challenged)
+        
+        if challenger_key == challenged_key:
+            logger.error("User %s attempted to challenge themselves", challenger)
             raise ValueError("Users cannot challenge themselves")
             
         try:
             wager_amount = int(wager_amount)
             if wager_amount < 0:
-                logger.warning(f"Negative wager amount ({wager_amount}) provided, setting to 0")
+                logger.warning("Negative wager amount (%s) provided, setting to 0", wager_amount)
                 wager_amount = 0
         except (ValueError, TypeError):
-            logger.warning(f"Invalid wager amount ({wager_amount}) provided, setting to 0")
+            logger.warning("Invalid wager amount (%s) provided, setting to 0", wager_amount)
             wager_amount = 0
             
-        # Check if user already has an active challenge
-        existing_challenge = self.find_user_challenge(challenger)
-        if existing_challenge:
-            logger.warning(f"User {challenger} already has an active challenge: {existing_challenge}")
-            raise ValueError(f"User already has an active challenge: {existing_challenge}")
-        
         with self._lock:
+            # Check if user already has an active challenge
+            existing_challenge = self._by_challenger.get(challenger_key)
+            if existing_challenge:
+                logger.warning("User %s already has an active challenge: %s", challenger, existing_challenge)
+                raise ValueError(f"User already has an active challenge: {existing_challenge}")
+            
             self._challenge_counter += 1
             challenge_id = f"challenge_{self._challenge_counter}"
             
-            self._active_challenges[challenge_id] = {
-                'challenger_user': challenger,
-                'challenged_user': challenged,
-                'wager_amount': wager_amount,
-                'timestamp': datetime.now().isoformat(),
-                'status': 'pending'  # Add a status field for better tracking
-            }
-            
-            save_success = self._save_state()
-            if not save_success:
-                logger.warning(f"Failed to save state after creating challenge {challenge_id}")
-            
-            logger.info(f"Challenge {challenge_id} created: {challenger} vs {challenged} with {wager_amount} marbles")
+            challenge = Challenge(
+                challenger, challenged, wager_amount,
+                challenger_lower=challenger_key, challenged_lower=challenged_key
+            )
+            self._active_challenges[challenge_id] = challenge
+            heapq.heappush(self._expiry_heap, (challenge.created_at, challenge_id))
+            self._by_challenger[challenger_key] = challenge_id
+            self._by_challenged.setdefault(challenged_key, set()).add(challenge_id)
+            self._dirty = True
+            
+            logger.info("Challenge %s created: %s vs %s with %s marbles", challenge_id, challenger, challenged, wager_amount)
             return challenge_id
     
-    def get_challenge(self, challenge_id: str) -> Optional[Dict[str, Any]]:
+    def get_challenge(self, challenge_id: str) -> Optional[Challenge]:
         """
         Get a challenge by ID.
         
@@ -155,8 +338,8 @@ class ChallengeManager:
         Returns:
             Challenge data or None if not found
         """
-        with self._lock:
-            return self._active_challenges.get(challenge_id)
+        self._ensure_loaded()
+        return self._active_challenges.get(challenge_id)
     
     def update_challenge(self, challenge_id: str, data: Dict[str, Any]) -> bool:
         """
@@ -164,7 +347,7 @@ class ChallengeManager:
         
         Args:
             challenge_id: ID of the challenge
-            data: New challenge data
+            data: New values keyed by Challenge field name (e.g. wager_amount, status)
             
         Returns:
             True if the challenge was updated, False otherwise
@@ -172,12 +355,13 @@ class ChallengeManager:
         Raises:
             ValueError: If data is not a dictionary
         """
+        self._ensure_loaded()
         if not challenge_id:
             logger.error("Empty challenge_id provided to update_challenge")
             return False
             
         if not isinstance(data, dict):
-            logger.error(f"Invalid data type provided to update_challenge: {type(data)}")
+            logger.error("Invalid data type provided to update_challenge: %s", type(data))
             raise ValueError("Data must be a dictionary")
             
         # Validate specific fields if present
@@ -185,36 +369,41 @@ class ChallengeManager:
             try:
                 data['wager_amount'] = int(data['wager_amount'])
                 if data['wager_amount'] < 0:
-                    logger.warning(f"Negative wager amount ({data['wager_amount']}) provided, setting to 0")
+                    logger.warning("Negative wager amount (%s) provided, setting to 0", data['wager_amount'])
                     data['wager_amount'] = 0
             except (ValueError, TypeError):
-                logger.warning(f"Invalid wager amount ({data['wager_amount']}) provided, setting to 0")
+                logger.warning("Invalid wager amount (%s) provided, setting to 0", data['wager_amount'])
                 data['wager_amount'] = 0
                 
-        if 'status' in data and data['status'] not in ['pending', 'accepted', 'declined', 'completed', 'expired']:
-            logger.warning(f"Invalid status value: {data['status']}, ignoring")
+        unknown_fields = data.keys() - self._UPDATABLE_FIELDS
+        if unknown_fields:
+            logger.warning("Ignoring unknown challenge fields: %s", sorted(unknown_fields))
+            data = {key: value for key, value in data.items() if key in self._UPDATABLE_FIELDS}
+                
+        if 'status' in data and data['status'] not in VALID_STATUSES:
+            logger.warning("Invalid status value: %s, ignoring", data['status'])
             del data['status']
         
         with self._lock:
             if challenge_id not in self._active_challenges:
-                logger.warning(f"Attempted to update non-existent challenge {challenge_id}")
-                return False
-            
-            # Keep a copy of the original data for logging
-            original_data = dict(self._active_challenges[challenge_id])
-            
-            # Update the challenge
-            self._active_challenges[challenge_id].update(data)
-            
-            # Save the state
-            save_success = self._save_state()
-            if not save_success:
-                logger.warning(f"Failed to save state after updating challenge {challenge_id}")
-                # Revert the changes if save failed
-                self._active_challenges[challenge_id] = original_data
+                logger.warning("Attempted to update non-existent challenge %s", challenge_id)
                 return False
             
-            logger.info(f"Challenge {challenge_id} updated: {data}")
+            # Update the challenge, skipping the flush when nothing actually changes
+            challenge = self._active_challenges[challenge_id]
+            data = {key: value for key, value in data.items() if getattr(challenge, key) != value}
+            if not data:
+                logger.debug("Challenge %s update changed nothing", challenge_id)
+                return True
+            
+            for key, value in data.items():
+                setattr(challenge, key, value)
+            if 'challenger' in data or 'challenged' in data:
+                challenge.refresh_usernames()
+                self._rebuild_index()
+            self._dirty = True
+            
+            logger.info("Challenge %s updated: %s", challenge_id, data)
             return True
     
     def remove_challenge(self, challenge_id: str) -> bool:
@@ -227,30 +416,22 @@ class ChallengeManager:
         Returns:
             True if the challenge was removed, False otherwise
         """
+        self._ensure_loaded()
         if not challenge_id:
             logger.error("Empty challenge_id provided to remove_challenge")
             return False
             
         with self._lock:
             if challenge_id not in self._active_challenges:
-                logger.warning(f"Attempted to remove non-existent challenge {challenge_id}")
+                logger.warning("Attempted to remove non-existent challenge %s", challenge_id)
                 return False
             
-            # Keep a copy of the challenge for logging and potential recovery
-            removed_challenge = dict(self._active_challenges[challenge_id])
-            
             # Remove the challenge
-            del self._active_challenges[challenge_id]
-            
-            # Save the state
-            save_success = self._save_state()
-            if not save_success:
-                logger.warning(f"Failed to save state after removing challenge {challenge_id}")
-                # Revert the removal if save failed
-                self._active_challenges[challenge_id] = removed_challenge
-                return False
+            removed_challenge = self._active_challenges.pop(challenge_id)
+            self._unindex_challenge(challenge_id, removed_challenge)
+            self._dirty = True
             
-            logger.info(f"Challenge {challenge_id} removed: {removed_challenge}")
+            logger.info("Challenge %s removed: %s", challenge_id, removed_challenge)
             return True
     
     def find_user_challenge(self, username: str) -> Optional[str]:
@@ -266,26 +447,39 @@ class ChallengeManager:
         Raises:
             ValueError: If username is empty or None
         """
+        self._ensure_loaded()
         if not username:
             logger.error("Empty username provided to find_user_challenge")
             raise ValueError("Username cannot be empty")
             
-        username = username.lower().strip()
-        if username.startswith('@'):
-            username = username[1:]  # Remove @ prefix if present
+        username = self._normalize_username(username)
+            
+        challenge_id = self._by_challenger.get(username)
+        if challenge_id:
+            logger.debug("Found challenge %s for user %s", challenge_id, username)
+            return challenge_id
+        
+        logger.debug("No active challenges found for user %s", username)
+        return None
+    
+    def find_challenges_for(self, username: str) -> Dict[str, Challenge]:
+        """
+        Find the challenges in which a user is the challenged party.
+        
+        Args:
+            username: Username of the challenged user
             
+        Returns:
+            Dictionary of matching challenges keyed by challenge ID
+        """
+        self._ensure_loaded()
+        username = self._normalize_username(username)
+        
         with self._lock:
-            for challenge_id, data in self._active_challenges.items():
-                challenger = data.get('challenger_user', '').lower().strip()
-                if challenger.startswith('@'):
-                    challenger = challenger[1:]  # Remove @ prefix if present
-                    
-                if challenger == username:
-                    logger.debug(f"Found challenge {challenge_id} for user {username}")
-                    return challenge_id
-            
-            logger.debug(f"No active challenges found for user {username}")
-            return None
+            return {
+                challenge_id: self._active_challenges[challenge_id]
+                for challenge_id in self._by_challenged.get(username, ())
+            }
     
     def cleanup_expired_challenges(self, expiry_hours: int = 24) -> List[str]:
         """
@@ -297,72 +491,48 @@ class ChallengeManager:
         Returns:
             List of removed challenge IDs
         """
+        self._ensure_loaded()
         if expiry_hours <= 0:
-            logger.warning(f"Invalid expiry_hours value: {expiry_hours}, using default of 24")
+            logger.warning("Invalid expiry_hours value: %s, using default of 24", expiry_hours)
             expiry_hours = 24
             
         with self._lock:
-            now = datetime.now()
             expired_ids = []
             removed_challenges = {}
             
-            for challenge_id, data in list(self._active_challenges.items()):
-                try:
-                    # Skip challenges that don't have a timestamp
-                    if 'timestamp' not in data:
-                        logger.warning(f"Challenge {challenge_id} has no timestamp, marking for removal")
-                        expired_ids.append(challenge_id)
-                        removed_challenges[challenge_id] = dict(data)
-                        del self._active_challenges[challenge_id]
-                        continue
-                        
-                    # Parse the timestamp
-                    try:
-                        challenge_time = datetime.fromisoformat(data['timestamp'])
-                    except (ValueError, TypeError):
-                        logger.warning(f"Challenge {challenge_id} has invalid timestamp: {data.get('timestamp')}, marking for removal")
-                        expired_ids.append(challenge_id)
-                        removed_challenges[challenge_id] = dict(data)
-                        del self._active_challenges[challenge_id]
-                        continue
-                    
-                    # Check if the challenge has expired
-                    if (now - challenge_time).total_seconds() > expiry_hours * 3600:
-                        logger.debug(f"Challenge {challenge_id} has expired (created: {challenge_time})")
-                        expired_ids.append(challenge_id)
-                        removed_challenges[challenge_id] = dict(data)
-                        del self._active_challenges[challenge_id]
-                        
-                except Exception as e:
-                    logger.error(f"Error processing challenge {challenge_id} during cleanup: {e}")
-                    # Remove malformed challenges
-                    expired_ids.append(challenge_id)
-                    removed_challenges[challenge_id] = dict(data)
-                    del self._active_challenges[challenge_id]
+            # Pop only the challenges created before the cutoff from the oldest-first heap
+            cutoff = datetime.now() - timedelta(hours=expiry_hours)
+            heap = self._expiry_heap
+            while heap and heap[0][0] < cutoff:
+                created_at, challenge_id = heapq.heappop(heap)
+                challenge = self._active_challenges.get(challenge_id)
+                # Skip entries of challenges that were already removed
+                if challenge is None or challenge.created_at != created_at:
+                    continue
+                logger.debug("Challenge %s has expired (created: %s)", challenge_id, created_at)
+                expired_ids.append(challenge_id)
+                removed_challenges[challenge_id] = self._active_challenges.pop(challenge_id)
             
             if expired_ids:
-                save_success = self._save_state()
-                if not save_success:
-                    logger.warning("Failed to save state after cleaning up expired challenges")
-                    # Revert the removals if save failed
-                    for challenge_id, data in removed_challenges.items():
-                        self._active_challenges[challenge_id] = data
-                    return []
-                    
-                logger.info(f"Cleaned up {len(expired_ids)} expired challenges")
+                for challenge_id, challenge in removed_challenges.items():
+                    self._unindex_challenge(challenge_id, challenge)
+                self._dirty = True
+                
+                logger.info("Cleaned up %s expired challenges", len(expired_ids))
             
             return expired_ids
     
-    def get_all_challenges(self) -> Dict[str, Dict[str, Any]]:
+    def get_all_challenges(self) -> Mapping[str, Challenge]:
         """
         Get all active challenges.
         
         Returns:
-            Dictionary of all active challenges
+            Read-only live view of the active challenges; copy it with dict()
+            to iterate while challenges may be created or removed
         """
-        with self._lock:
-            # Return a copy to prevent external modification
-            return dict(self._active_challenges)
+        self._ensure_loaded()
+        # A read-only view prevents external modification without copying
+        return MappingProxyType(self._active_challenges)
     
     def get_challenge_count(self) -> int:
         """
@@ -371,8 +541,8 @@ class ChallengeManager:
         Returns:
             Number of active challenges
         """
-        with self._lock:
-            return len(self._active_challenges)
+        self._ensure_loaded()
+        return len(self._active_challenges)
     
     def get_challenge_counter(self) -> int:
         """
@@ -381,5 +551,5 @@ class ChallengeManager:
         Returns:
             Current challenge counter value
         """
-        with self._lock:
-            return self._challenge_counter
\ No newline at end of file
+        self._ensure_loaded()
+        return self._challenge_counter
\ No newline at end of file
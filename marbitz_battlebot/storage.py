@@ -7,8 +7,15 @@ This module handles data persistence for leaderboards and other data.
 import json
 import logging
 import os
+import shutil
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup; fall back to the stdlib encoder
+    orjson = None
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -19,6 +26,41 @@ WEEKLY_LEADERBOARD_FILE = 'weekly_leaderboard.json'
 WEEKLY_RESET_FILE = 'weekly_reset.json'
 CHALLENGES_FILE = 'challenges.json'
 
+# Leaderboard journals are compacted into the snapshot once they grow past this
+# multiple of the snapshot size (and past a minimum size for small leaderboards)
+JOURNAL_COMPACT_RATIO = 10
+JOURNAL_COMPACT_MIN_BYTES = 64 * 1024
+
+# Hash of the bytes last written to each file and the file's mtime right after,
+# so a save that would write identical content can be skipped
+_last_saved: Dict[str, Tuple[int, Optional[int]]] = {}
+
+# Days the weekly reset can be configured for
+_VALID_DAYS = frozenset({'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'})
+
+# Weekly reset info is checked on every battle; keep the last read keyed by file mtime
+_reset_info_cache: Optional[tuple] = None  # (mtime_ns, reset_info)
+_reset_info_lock = threading.Lock()
+
+def _file_mtime(filename: str) -> Optional[int]:
+    """Get a file's modification time in nanoseconds, or None if it does not exist."""
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+def _dumps(data: Any) -> bytes:
+    """Serialize data to compact UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+def _loads(data: bytes) -> Any:
+    """Parse JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 def load_json_file(filename: str) -> Dict[str, Any]:
     """Load data from JSON file.
     
@@ -36,8 +78,8 @@ def load_json_file(filename: str) -> Dict[str, Any]:
         raise ValueError("Filename cannot be empty")
         
     try:
-        with open(filename, 'r') as f:
-            data = json.load(f)
+        with open(filename, 'rb') as f:
+            data = _loads(f.read())
             if not isinstance(data, dict):
                 logger.warning(f"File {filename} did not contain a dictionary. Converting to empty dict.")
                 return {}
@@ -55,6 +97,34 @@ def load_json_file(filename: str) -> Dict[str, Any]:
         logger.error(f"Unexpected error loading {filename}: {str(e)}. Returning empty dictionary.")
         return {}
 
+def _backup_file(filename: str) -> None:
+    """Keep the current version of a file as its .bak before it is replaced.
+    
+    A hard link is only a directory entry; replacing the file gives filename a
+    new inode, so the old contents live on under the .bak name without being copied.
+    
+    Args:
+        filename: Path to the file that is about to be replaced
+    """
+    backup_filename = f"{filename}.bak"
+    try:
+        try:
+            os.link(filename, backup_filename)
+        except FileExistsError:
+            os.remove(backup_filename)
+            os.link(filename, backup_filename)
+        logger.debug(f"Created backup of {filename} at {backup_filename}")
+    except FileNotFoundError:
+        pass  # First save, nothing to back up
+    except OSError:
+        # Filesystem without hard links
+        try:
+            shutil.copyfile(filename, backup_filename)
+        except Exception as e:
+            logger.warning(f"Failed to create backup of {filename}: {str(e)}")
+    except Exception as e:
+        logger.warning(f"Failed to create backup of {filename}: {str(e)}")
+
 def save_json_file(data: Dict[str, Any], filename: str) -> bool:
     """Save data to JSON file.
     
@@ -77,19 +147,26 @@ def save_json_file(data: Dict[str, Any], filename: str) -> bool:
         raise ValueError("Data must be a dictionary")
     
     try:
-        # Create a backup of the existing file if it exists
-        try:
-            if os.path.exists(filename):
-                backup_filename = f"{filename}.bak"
-                with open(filename, 'r') as src, open(backup_filename, 'w') as dst:
-                    dst.write(src.read())
-                logger.debug(f"Created backup of {filename} at {backup_filename}")
-        except Exception as e:
-            logger.warning(f"Failed to create backup of {filename}: {str(e)}")
+        payload = _dumps(data)
         
-        # Write the new data
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
+        # Skip the write if the file still holds exactly what we last wrote
+        content_hash = hash(payload)
+        mtime = _file_mtime(filename)
+        if mtime is not None and _last_saved.get(filename) == (content_hash, mtime):
+            logger.debug(f"{filename} is unchanged, skipping save")
+            return True
+        
+        _backup_file(filename)
+        
+        # Write the new data to a temp file in one call, make sure it reached the
+        # disk, and only then swap it in atomically
+        temp_filename = f"{filename}.tmp"
+        with open(temp_filename, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, filename)
+        _last_saved[filename] = (content_hash, _file_mtime(filename))
         
         logger.debug(f"Successfully saved data to {filename}")
         return True
@@ -103,8 +180,111 @@ def save_json_file(data: Dict[str, Any], filename: str) -> bool:
         logger.error(f"Unexpected error saving data to {filename}: {str(e)}")
         return False
 
+def journal_filename(filename: str) -> str:
+    """Get the path of the battle journal that belongs to a leaderboard file."""
+    return f"{filename}.journal"
+
+def _compacted_filename(filename: str) -> str:
+    """Get the path a compacted leaderboard snapshot is written to before it is moved into place."""
+    return f"{filename}.compact"
+
+def append_battle_deltas(deltas: Iterable[Tuple[str, str, int, float]],
+                         filename: str = OVERALL_LEADERBOARD_FILE) -> bool:
+    """Append battle results to a leaderboard's journal.
+    
+    Each result is written as one JSON line, so the cost of a write depends on
+    the number of new battles rather than the size of the leaderboard.
+    
+    Args:
+        deltas: Tuples of (winner, loser, marble_change, timestamp)
+        filename: Path to the leaderboard file
+        
+    Returns:
+        True if the results were appended, False otherwise
+    """
+    lines = b''.join(
+        _dumps({'winner': winner, 'loser': loser, 'marbles': marbles, 'ts': ts}) + b'\n'
+        for winner, loser, marbles, ts in deltas
+    )
+    try:
+        with open(journal_filename(filename), 'a+b') as f:
+            # A crash can leave a torn last line behind; start on a fresh line
+            # so these results are not glued onto it and skipped on replay
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    lines = b'\n' + lines
+            f.write(lines)
+        return True
+    except OSError as e:
+        logger.error(f"Error appending to journal of {filename}: {str(e)}")
+        return False
+
+def _replay_journal(leaderboard: Dict[str, Dict[str, int]], filename: str) -> int:
+    """Apply the journaled battle results of a leaderboard to its snapshot in place.
+    
+    Args:
+        leaderboard: Normalized snapshot loaded from the leaderboard file
+        filename: Path to the leaderboard file
+        
+    Returns:
+        Number of battle results that were applied
+    """
+    try:
+        f = open(journal_filename(filename), 'rb')
+    except FileNotFoundError:
+        return 0
+    
+    applied = 0
+    with f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                delta = _loads(line)
+                winner, loser, marbles = delta['winner'], delta['loser'], int(delta['marbles'])
+                for user in (winner, loser):
+                    leaderboard.setdefault(user, {'wins': 0, 'losses': 0, 'marbles': 0})
+                leaderboard[winner]['wins'] += 1
+                leaderboard[winner]['marbles'] += marbles
+                leaderboard[loser]['losses'] += 1
+                leaderboard[loser]['marbles'] -= marbles
+                applied += 1
+            except (ValueError, KeyError, TypeError) as e:
+                # A crash can leave a partial last line behind
+                logger.warning(f"Skipping invalid journal line {line_number} of {filename}: {str(e)}")
+    return applied
+
+def _normalize_leaderboard(leaderboard: Dict[str, Any], filename: str) -> Dict[str, Dict[str, int]]:
+    """Validate a loaded leaderboard once so later code can trust its structure.
+    
+    Entries with an invalid username or stats are dropped, and every user ends
+    up with int wins, losses and marbles.
+    
+    Args:
+        leaderboard: Leaderboard data as parsed from disk
+        filename: Path to the leaderboard file, for logging
+        
+    Returns:
+        Dictionary containing only well-formed entries
+    """
+    normalized = {}
+    for username, stats in leaderboard.items():
+        if not username or not isinstance(stats, dict):
+            logger.warning(f"Dropping invalid leaderboard entry for {username!r} in {filename}")
+            continue
+        
+        valid_stats = {}
+        for field in ('wins', 'losses', 'marbles'):
+            value = stats.get(field)
+            if isinstance(value, (int, float)):
+                valid_stats[field] = int(value)
+            else:
+                logger.warning(f"Invalid or missing {field} for user {username} in {filename}, using 0")
+                valid_stats[field] = 0
+        normalized[username] = valid_stats
+    return normalized
+
 def load_leaderboard(filename: str = OVERALL_LEADERBOARD_FILE) -> Dict[str, Dict[str, int]]:
-    """Load leaderboard from JSON file.
+    """Load leaderboard from its JSON snapshot and battle journal.
     
     Args:
         filename: Path to the leaderboard file
@@ -112,7 +292,12 @@ def load_leaderboard(filename: str = OVERALL_LEADERBOARD_FILE) -> Dict[str, Dict
     Returns:
         Dictionary containing the leaderboard data
     """
-    return load_json_file(filename)
+    _recover_compaction(filename)
+    leaderboard = _normalize_leaderboard(load_json_file(filename), filename)
+    applied = _replay_journal(leaderboard, filename)
+    if applied:
+        logger.info(f"Replayed {applied} journaled battles onto {filename}")
+    return leaderboard
 
 def save_leaderboard(leaderboard: Dict[str, Dict[str, int]], 
                     filename: str = OVERALL_LEADERBOARD_FILE) -> bool:
@@ -129,25 +314,133 @@ def save_leaderboard(leaderboard: Dict[str, Dict[str, int]],
         logger.error(f"Invalid leaderboard data type: {type(leaderboard)}")
         return False
         
-    # Validate leaderboard structure
-    for username, stats in leaderboard.items():
-        if not isinstance(stats, dict):
-            logger.error(f"Invalid stats type for user {username}: {type(stats)}")
-            return False
+    # Boards are normalized when they are loaded, so a bad entry here is a
+    # programming error; the O(n) check is skipped under python -O
+    if __debug__:
+        for username, stats in leaderboard.items():
+            if not isinstance(stats, dict):
+                logger.error(f"Invalid stats type for user {username}: {type(stats)}")
+                return False
     
     return save_json_file(leaderboard, filename)
 
+def journal_needs_compaction(filename: str = OVERALL_LEADERBOARD_FILE) -> bool:
+    """Check whether a leaderboard's journal has outgrown its snapshot.
+    
+    Args:
+        filename: Path to the leaderboard file
+        
+    Returns:
+        True if the journal should be folded into the snapshot
+    """
+    try:
+        journal_size = os.path.getsize(journal_filename(filename))
+    except OSError:
+        return False
+    try:
+        snapshot_size = os.path.getsize(filename)
+    except OSError:
+        snapshot_size = 0
+    return journal_size > max(JOURNAL_COMPACT_MIN_BYTES, JOURNAL_COMPACT_RATIO * snapshot_size)
+
+def compact_leaderboard(leaderboard: Dict[str, Dict[str, int]],
+                        filename: str = OVERALL_LEADERBOARD_FILE) -> bool:
+    """Write a full leaderboard snapshot and empty its journal.
+    
+    The new snapshot is first saved next to the old one. Removing the journal
+    commits the compaction, after which the new snapshot is moved into place;
+    a crash at any point leaves either the old snapshot with its complete
+    journal or a committed snapshot that the next load moves into place, so no
+    journaled battle is lost or counted twice.
+    
+    Args:
+        leaderboard: Complete leaderboard data, including every journaled battle
+        filename: Path to the leaderboard file
+        
+    Returns:
+        True if the snapshot was saved, False otherwise
+    """
+    compacted = _compacted_filename(filename)
+    if not save_leaderboard(leaderboard, compacted):
+        return False
+    
+    try:
+        os.remove(journal_filename(filename))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not remove the journal of {filename}, keeping the old snapshot: {str(e)}")
+        try:
+            os.remove(compacted)
+        except OSError:
+            pass  # Discarded again by the next load
+        return False
+    
+    # The compaction is committed; a failed move is finished by the next load
+    _finish_compaction(filename)
+    return True
+
+def _finish_compaction(filename: str) -> bool:
+    """Move a committed compacted snapshot into place.
+    
+    Args:
+        filename: Path to the leaderboard file
+        
+    Returns:
+        True if the snapshot was moved, False otherwise
+    """
+    _backup_file(filename)
+    try:
+        os.replace(_compacted_filename(filename), filename)
+        return True
+    except OSError as e:
+        logger.error(f"Could not move the compacted snapshot of {filename} into place: {str(e)}")
+        return False
+
+def _recover_compaction(filename: str) -> None:
+    """Finish or roll back a compaction that was interrupted by a crash.
+    
+    While the journal still exists the compaction was not committed, so the
+    old snapshot and journal are complete and the new snapshot is discarded.
+    
+    Args:
+        filename: Path to the leaderboard file
+    """
+    compacted = _compacted_filename(filename)
+    if not os.path.exists(compacted):
+        return
+    if os.path.exists(journal_filename(filename)):
+        logger.warning(f"Discarding uncommitted compaction of {filename}")
+        try:
+            os.remove(compacted)
+        except OSError as e:
+            logger.error(f"Could not remove {compacted}: {str(e)}")
+    elif _finish_compaction(filename):
+        logger.info(f"Finished interrupted compaction of {filename}")
+
 def get_weekly_reset_info() -> Dict[str, Any]:
     """Get information about the weekly reset.
     
+    The file is only parsed again when its modification time changes.
+    
     Returns:
         Dictionary containing reset information
     """
+    global _reset_info_cache
     try:
+        mtime = _file_mtime(WEEKLY_RESET_FILE)
+        with _reset_info_lock:
+            cached = _reset_info_cache
+        if cached is not None and mtime is not None and cached[0] == mtime:
+            return dict(cached[1])
+        
         reset_info = load_json_file(WEEKLY_RESET_FILE)
         if not reset_info:
             # Default to Monday reset if no info exists
             reset_info = {'reset_day': 'Monday', 'last_reset': None}
+        elif mtime is not None:
+            with _reset_info_lock:
+                _reset_info_cache = (mtime, dict(reset_info))
         return reset_info
     except Exception as e:
         logger.error(f"Error getting weekly reset info: {e}")
@@ -162,6 +455,7 @@ def save_weekly_reset_info(reset_info: Dict[str, Any]) -> bool:
     Returns:
         True if save was successful, False otherwise
     """
+    global _reset_info_cache
     if not isinstance(reset_info, dict):
         logger.error(f"Invalid reset_info data type: {type(reset_info)}")
         return False
@@ -172,11 +466,14 @@ def save_weekly_reset_info(reset_info: Dict[str, Any]) -> bool:
         reset_info['reset_day'] = 'Monday'  # Set default
         
     # Validate reset_day value
-    valid_days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    if reset_info.get('reset_day') not in valid_days:
+    if reset_info.get('reset_day') not in _VALID_DAYS:
         logger.error(f"Invalid reset_day value: {reset_info.get('reset_day')}")
         reset_info['reset_day'] = 'Monday'  # Set default
     
-    return save_json_file(reset_info, WEEKLY_RESET_FILE)
+    saved = save_json_file(reset_info, WEEKLY_RESET_FILE)
+    with _reset_info_lock:
+        mtime = _file_mtime(WEEKLY_RESET_FILE) if saved else None
+        _reset_info_cache = (mtime, dict(reset_info)) if mtime is not None else None
+    return saved
 
 # These functions are now handled by the ChallengeManager class in state.py
\ No newline at end of file
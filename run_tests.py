@@ -6,24 +6,22 @@ Script to run tests for Marbitz Battlebot.
 import os
 import sys
 import subprocess
+import importlib.util
 
 def run_tests():
     """Run the test suite."""
     print("Running Marbitz Battlebot tests...")
     
-    # Run pytest with coverage
-    result = subprocess.run(
-        ["pytest", "--cov=marbitz_battlebot", "--cov-report=term-missing"],
-        capture_output=True,
-        text=True
-    )
+    args = ["pytest", "--cov=marbitz_battlebot", "--cov-report=term-missing"]
     
-    # Print the output
-    print(result.stdout)
+    # Spread the suite over all cores when pytest-xdist is installed; loadfile
+    # keeps each test file on one worker so the singleton resets stay in order
+    if importlib.util.find_spec("xdist") is not None:
+        args += ["-n", "auto", "--dist=loadfile"]
     
-    if result.stderr:
-        print("Errors:")
-        print(result.stderr)
+    # Run pytest with coverage, streaming its output as the tests run
+    sys.stdout.flush()
+    result = subprocess.run(args)
     
     # Return the exit code
     return result.returncode
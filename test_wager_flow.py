@@ -31,10 +31,10 @@ def test_wager_functionality():
         challenge_data = get_challenge(challenge_id)
         if challenge_data:
             print(f"✅ Challenge data retrieved:")
-            print(f"   - Challenger: {challenge_data.get('challenger_user')}")
-            print(f"   - Challenged: {challenge_data.get('challenged_user')}")
-            print(f"   - Wager: {challenge_data.get('wager_amount')} marbles")
-            print(f"   - Status: {challenge_data.get('status')}")
+            print(f"   - Challenger: {challenge_data.challenger}")
+            print(f"   - Challenged: {challenge_data.challenged}")
+            print(f"   - Wager: {challenge_data.wager_amount} marbles")
+            print(f"   - Status: {challenge_data.status}")
         else:
             print("❌ Failed to retrieve challenge data")
             return False
@@ -52,8 +52,8 @@ def test_wager_functionality():
             
             # Verify update
             updated_data = get_challenge(challenge_id)
-            if updated_data and updated_data.get('wager_amount') == 100:
-                print(f"✅ Wager amount verified: {updated_data.get('wager_amount')} marbles")
+            if updated_data and updated_data.wager_amount == 100:
+                print(f"✅ Wager amount verified: {updated_data.wager_amount} marbles")
             else:
                 print("❌ Wager amount update verification failed")
                 return False
@@ -72,8 +72,8 @@ def test_wager_functionality():
         print(f"✅ Zero-wager challenge created with ID: {challenge_id_2}")
         
         challenge_data_2 = get_challenge(challenge_id_2)
-        if challenge_data_2 and challenge_data_2.get('wager_amount') == 0:
-            print(f"✅ Zero wager verified: {challenge_data_2.get('wager_amount')} marbles")
+        if challenge_data_2 and challenge_data_2.wager_amount == 0:
+            print(f"✅ Zero wager verified: {challenge_data_2.wager_amount} marbles")
         else:
             print("❌ Zero wager verification failed")
             return False
@@ -8,11 +8,16 @@ import tempfile
 import pytest
 from unittest.mock import MagicMock, patch
 
+@pytest.fixture(scope="session")
+def _tmp_root():
+    """Create one temporary directory for the whole session, removed at the end."""
+    with tempfile.TemporaryDirectory() as root:
+        yield root
+
 @pytest.fixture
-def temp_dir():
-    """Create a temporary directory for test files."""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        yield temp_dir
+def temp_dir(_tmp_root):
+    """Create a fresh temporary directory for test files under the session root."""
+    return tempfile.mkdtemp(dir=_tmp_root)
 
 @pytest.fixture
 def mock_update():
@@ -8,7 +8,8 @@ from unittest.mock import patch, MagicMock, AsyncMock
 from telegram.ext import ConversationHandler
 
 from marbitz_battlebot.handlers import (
-    start_command, help_command
+    start_command, help_command, my_stats_command, leaderboard_command, stream_battle_phases,
+    WAGER_RE, wager_error_text
 )
 
 class TestHandlers:
@@ -40,4 +41,63 @@ class TestHandlers:
         # Assert
         mock_update.message.reply_text.assert_called_once()
         args, kwargs = mock_update.message.reply_text.call_args
-        assert "Marbitz Battlebot Commands" in args[0]
\ No newline at end of file
+        assert "Marbitz Battlebot Commands" in args[0]
+    
+    @pytest.mark.asyncio
+    async def test_stream_battle_phases_sends_in_order(self):
+        """Test that battle phases are sent in order."""
+        # Arrange
+        bot = MagicMock()
+        bot.send_message = AsyncMock()
+        phases = ["phase 1", "phase 2", "phase 3"]
+        
+        # Act
+        with patch('marbitz_battlebot.handlers.asyncio.sleep', new=AsyncMock()):
+            await stream_battle_phases(bot, 67890, 1, phases)
+        
+        # Assert
+        sent = [call.kwargs['text'] for call in bot.send_message.call_args_list]
+        assert sent == phases
+    
+    def test_wager_validation(self):
+        """Test that wager input is accepted and rejected with the right message."""
+        # Act & Assert
+        for text in ["1", "50", "0050", "1000"]:
+            assert WAGER_RE.match(text)
+        for text in ["0", "-5", "1001", "abc", "", "²"]:
+            assert not WAGER_RE.match(text)
+        assert "valid number" in wager_error_text("abc")
+        assert "positive number" in wager_error_text("-5")
+        assert "Maximum wager" in wager_error_text("1001")
+    
+    @pytest.mark.asyncio
+    async def test_my_stats_command(self, mock_update, mock_context):
+        """Test that /my_stats replies with the caller's stats without touching args."""
+        # Arrange
+        mock_update.message.reply_text = AsyncMock()
+        row = {'wins': 3, 'losses': 1, 'marbles': 20, 'total': 4, 'winrate_str': '75.0'}
+        
+        # Act
+        with patch('marbitz_battlebot.handlers.get_user_summary', return_value=(row, row)):
+            await my_stats_command(mock_update, mock_context)
+        
+        # Assert
+        assert mock_context.args == []
+        text = mock_update.message.reply_text.call_args.args[0]
+        assert "Stats for @test_user" in text
+        assert "75.0%" in text
+    
+    @pytest.mark.asyncio
+    async def test_handler_error_sends_generic_message(self, mock_update, mock_context):
+        """Test that an unexpected handler error is reported to the user."""
+        # Arrange
+        mock_update.callback_query = None
+        mock_update.effective_message.reply_text = AsyncMock()
+        
+        # Act
+        with patch('marbitz_battlebot.handlers.get_rendered_leaderboard_async', side_effect=RuntimeError("boom")):
+            await leaderboard_command(mock_update, mock_context)
+        
+        # Assert
+        args, kwargs = mock_update.effective_message.reply_text.call_args
+        assert "unexpected error" in args[0]
@@ -2,10 +2,22 @@
 Unit tests for the leaderboard module.
 """
 
+import asyncio
+
 import pytest
 from unittest.mock import patch, MagicMock
 
-from marbitz_battlebot.leaderboard import format_leaderboard
+from marbitz_battlebot import leaderboard
+from marbitz_battlebot.leaderboard import (
+    format_leaderboard, update_leaderboard, update_leaderboard_async, get_leaderboard,
+    flush_leaderboards, get_rendered_leaderboard, reset_weekly_leaderboard,
+    OVERALL_LEADERBOARD_FILE, WEEKLY_LEADERBOARD_FILE
+)
+
+@pytest.fixture
+def clean_leaderboards(monkeypatch):
+    """Give the test its own empty leaderboard store."""
+    monkeypatch.setattr(leaderboard, 'store', leaderboard.LeaderboardStore())
 
 class TestLeaderboard:
     """Tests for the leaderboard module."""
@@ -42,4 +54,136 @@ class TestLeaderboard:
         assert "@user2" in result
         assert "@user3" in result
         assert "10W-2L" in result  # user1's record
-        assert "83.3%" in result  # user1's win rate (10/12 * 100)
\ No newline at end of file
+        assert "83.3%" in result  # user1's win rate (10/12 * 100)
+    
+    @patch('marbitz_battlebot.leaderboard.reset_weekly_leaderboard', return_value=False)
+    @patch('marbitz_battlebot.leaderboard.journal_needs_compaction', return_value=False)
+    @patch('marbitz_battlebot.leaderboard.append_battle_deltas', return_value=True)
+    @patch('marbitz_battlebot.leaderboard.load_leaderboard', side_effect=lambda filename: {})
+    def test_update_leaderboard_write_behind(self, mock_load, mock_save, mock_compact, mock_reset, clean_leaderboards):
+        """Test that updates stay in memory until the leaderboards are flushed."""
+        # Act
+        update_leaderboard("@user1", "user2", 25)
+        update_leaderboard("user1", "user2", 5)
+        
+        # Assert
+        mock_save.assert_not_called()
+        assert get_leaderboard(OVERALL_LEADERBOARD_FILE)["user1"] == {"wins": 2, "losses": 0, "marbles": 30}
+        assert leaderboard.store.get_summary(WEEKLY_LEADERBOARD_FILE, "user2")["winrate_str"] == "0.0"
+        assert flush_leaderboards()
+        assert mock_save.call_count == 2
+        saved = {call.args[1]: call.args[0] for call in mock_save.call_args_list}
+        assert [delta[:3] for delta in saved[WEEKLY_LEADERBOARD_FILE]] == [("user1", "user2", 25), ("user1", "user2", 5)]
+        assert flush_leaderboards()
+        assert mock_save.call_count == 2
+
+    @patch('marbitz_battlebot.leaderboard.reset_weekly_leaderboard', return_value=False)
+    @patch('marbitz_battlebot.leaderboard.load_leaderboard', side_effect=lambda filename: {})
+    def test_leaderboard_rendered_on_write(self, mock_load, mock_reset, clean_leaderboards):
+        """Test that battles re-render the leaderboard so reads never format it."""
+        # Act
+        update_leaderboard("user1", "user2", 10)
+        with patch('marbitz_battlebot.leaderboard.format_leaderboard') as mock_format:
+            text, plain = get_rendered_leaderboard(OVERALL_LEADERBOARD_FILE)
+        
+        # Assert
+        mock_format.assert_not_called()
+        assert "Overall Leaderboard" in text
+        assert "@user1" in text
+        assert "*" not in plain
+    
+    @patch('marbitz_battlebot.leaderboard.reset_weekly_leaderboard', return_value=False)
+    @patch('marbitz_battlebot.leaderboard.load_leaderboard', side_effect=lambda filename: {})
+    def test_ranking_matches_full_sort(self, mock_load, mock_reset, clean_leaderboards):
+        """Test that the incrementally maintained ranking renders like a full sort."""
+        # Arrange
+        battles = [("user1", "user2", 10), ("user3", "user1", 5), ("user3", "user2", 1),
+                   ("user2", "user4", 0), ("user3", "user4", 7), ("user1", "user4", 2)]
+        
+        # Act
+        for winner, loser, marbles in battles:
+            update_leaderboard(winner, loser, marbles)
+        text, _ = get_rendered_leaderboard(OVERALL_LEADERBOARD_FILE)
+        
+        # Assert
+        board = get_leaderboard(OVERALL_LEADERBOARD_FILE)
+        assert text == format_leaderboard(board, "🏆 Overall Leaderboard")
+        assert text.index("@user3") < text.index("@user1") < text.index("@user2") < text.index("@user4")
+    
+    @patch('marbitz_battlebot.leaderboard.reset_weekly_leaderboard', return_value=False)
+    @patch('marbitz_battlebot.leaderboard.load_leaderboard', side_effect=lambda filename: {})
+    def test_summary_of_unknown_user_is_not_stored(self, mock_load, mock_reset, clean_leaderboards):
+        """Test that looking up users who never battled does not add summary rows."""
+        # Arrange
+        update_leaderboard("user1", "user2", 4)
+        
+        # Act
+        known = leaderboard.store.get_summary(OVERALL_LEADERBOARD_FILE, "user1")
+        unknown = [leaderboard.store.get_summary(OVERALL_LEADERBOARD_FILE, f"random{i}") for i in range(3)]
+        
+        # Assert
+        assert known["wins"] == 1 and known["marbles"] == 4
+        assert all(row == {"wins": 0, "losses": 0, "marbles": 0, "total": 0, "winrate_str": "0.0"} for row in unknown)
+        assert set(leaderboard.store._derived[OVERALL_LEADERBOARD_FILE]) == {"user1", "user2"}
+    
+    @patch('marbitz_battlebot.leaderboard.should_reset_weekly_leaderboard')
+    @patch('marbitz_battlebot.leaderboard.save_weekly_reset_info', return_value=True)
+    @patch('marbitz_battlebot.leaderboard.compact_leaderboard', return_value=True)
+    @patch('marbitz_battlebot.leaderboard.load_leaderboard', side_effect=lambda filename: {})
+    def test_weekly_reset_drops_last_weeks_pending_results(self, mock_load, mock_compact, mock_save_info,
+                                                           mock_should_reset, clean_leaderboards):
+        """Test that unflushed results of last week are not journaled into the new week."""
+        # Arrange
+        lock_held = []
+        mock_compact.side_effect = lambda board, filename: lock_held.append(leaderboard.store._lock.locked()) or True
+        mock_should_reset.return_value = (False, {})
+        update_leaderboard("user1", "user2", 5)
+        mock_should_reset.return_value = (True, {'reset_day': 'Monday'})
+        
+        # Act
+        result = reset_weekly_leaderboard()
+        
+        # Assert
+        assert result is True
+        mock_compact.assert_called_once_with({}, WEEKLY_LEADERBOARD_FILE)
+        assert lock_held == [False]  # the event loop never waits on the rewrite
+        assert get_leaderboard(WEEKLY_LEADERBOARD_FILE) == {}
+        assert get_leaderboard(OVERALL_LEADERBOARD_FILE)["user1"]["wins"] == 1
+        assert WEEKLY_LEADERBOARD_FILE not in leaderboard.store._pending
+        assert OVERALL_LEADERBOARD_FILE in leaderboard.store._pending
+    
+    @patch('marbitz_battlebot.leaderboard.should_reset_weekly_leaderboard', return_value=(False, {}))
+    @patch('marbitz_battlebot.leaderboard.load_leaderboard', side_effect=lambda filename: {})
+    async def test_update_leaderboard_async_records_on_loop(self, mock_load, mock_should_reset, clean_leaderboards):
+        """Test that the async update records the result and wakes the flush loop."""
+        # Act
+        await update_leaderboard_async("@user1", "user2", 3)
+        
+        # Assert
+        assert get_leaderboard(WEEKLY_LEADERBOARD_FILE)["user1"] == {"wins": 1, "losses": 0, "marbles": 3}
+        assert leaderboard.store._dirty.is_set()
+    
+    @patch('marbitz_battlebot.leaderboard.should_reset_weekly_leaderboard', return_value=(False, {}))
+    @patch('marbitz_battlebot.leaderboard.journal_needs_compaction', return_value=False)
+    @patch('marbitz_battlebot.leaderboard.append_battle_deltas')
+    @patch('marbitz_battlebot.leaderboard.load_leaderboard', side_effect=lambda filename: {})
+    async def test_periodic_flush_retries_failed_flush(self, mock_load, mock_append, mock_compact,
+                                                       mock_should_reset, clean_leaderboards):
+        """Test that the flush loop retries results it could not write."""
+        # Arrange
+        mock_append.side_effect = [False, True, True, True]
+        await update_leaderboard_async("user1", "user2", 3)
+        
+        # Act
+        task = asyncio.create_task(leaderboard.store.periodic_flush(interval=0.01))
+        try:
+            for _ in range(100):
+                if not leaderboard.store.dirty:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+        
+        # Assert
+        assert not leaderboard.store.dirty
+        assert mock_append.call_count == 3
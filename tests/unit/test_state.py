@@ -3,6 +3,7 @@ Unit tests for the state module.
 """
 
 import pytest
+from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock
 
 from marbitz_battlebot.state import ChallengeManager
@@ -43,12 +44,17 @@ class TestChallengeManager:
         # Assert
         assert challenge_id.startswith("challenge_")
         assert manager.get_challenge(challenge_id) is not None
-        assert manager.get_challenge(challenge_id)['challenger_user'] == challenger
-        assert manager.get_challenge(challenge_id)['challenged_user'] == challenged
-        assert manager.get_challenge(challenge_id)['wager_amount'] == wager_amount
-        assert 'timestamp' in manager.get_challenge(challenge_id)
+        assert manager.get_challenge(challenge_id).challenger == challenger
+        assert manager.get_challenge(challenge_id).challenged == challenged
+        assert manager.get_challenge(challenge_id).challenged_lower == challenged.lower()
+        assert manager.get_challenge(challenge_id).wager_amount == wager_amount
+        assert manager.get_challenge(challenge_id).status == 'pending'
         
-        # Verify save was called
+        # Verify the challenge is only written to disk when flushed
+        mock_save.assert_not_called()
+        assert manager.flush()
+        mock_save.assert_called_once()
+        assert manager.flush()
         mock_save.assert_called_once()
     
     @patch('marbitz_battlebot.state.load_json_file')
@@ -67,6 +73,79 @@ class TestChallengeManager:
         
         # Assert
         assert challenge is not None
-        assert challenge['challenger_user'] == "user1"
-        assert challenge['challenged_user'] == "user2"
-        assert challenge['wager_amount'] == 10
\ No newline at end of file
+        assert challenge.challenger == "user1"
+        assert challenge.challenged == "user2"
+        assert challenge.wager_amount == 10
+    
+    @patch('marbitz_battlebot.state.load_json_file')
+    @patch('marbitz_battlebot.state.save_json_file')
+    def test_find_user_challenge_after_remove(self, mock_save, mock_load):
+        """Test that the username indexes follow creation and removal."""
+        # Arrange
+        mock_load.return_value = {}
+        ChallengeManager._instance = None  # Reset singleton
+        
+        manager = ChallengeManager()
+        challenge_id = manager.create_challenge("User1", "user2", 10)
+        
+        # Act
+        found = manager.find_user_challenge("@user1")
+        incoming = manager.find_challenges_for("@User2")
+        manager.remove_challenge(challenge_id)
+        
+        # Assert
+        assert found == challenge_id
+        assert list(incoming) == [challenge_id]
+        assert manager.find_user_challenge("user1") is None
+        assert manager.find_challenges_for("user2") == {}
+    
+    @patch('marbitz_battlebot.state.load_json_file')
+    @patch('marbitz_battlebot.state.save_json_file')
+    def test_challenges_round_trip_through_storage(self, mock_save, mock_load):
+        """Test that flushed challenges load back with the same fields."""
+        # Arrange
+        mock_load.return_value = {}
+        ChallengeManager._instance = None  # Reset singleton
+        manager = ChallengeManager()
+        challenge_id = manager.create_challenge("User1", "@User2", 25)
+        manager.flush()
+        saved = mock_save.call_args.args[0]
+        
+        # Act
+        mock_load.return_value = dict(saved, challenge_9={"challenger_user": "broken"})
+        ChallengeManager._instance = None
+        reloaded = ChallengeManager()
+        
+        # Assert
+        challenge = reloaded.get_challenge(challenge_id)
+        assert challenge == manager.get_challenge(challenge_id)
+        assert challenge.challenger_lower == "user1"
+        assert challenge.challenged_lower == "user2"
+        assert reloaded.get_challenge("challenge_9") is None
+        assert reloaded.get_challenge_counter() == 9
+        assert reloaded.find_user_challenge("user1") == challenge_id
+    
+    @patch('marbitz_battlebot.state.load_json_file')
+    @patch('marbitz_battlebot.state.save_json_file')
+    def test_cleanup_expired_challenges(self, mock_save, mock_load):
+        """Test that cleanup removes only expired challenges and skips removed ones."""
+        # Arrange
+        old = (datetime.now() - timedelta(hours=30)).isoformat()
+        mock_load.return_value = {
+            "challenge_1": {"challenger_user": "user1", "challenged_user": "user2", "timestamp": old},
+            "challenge_2": {"challenger_user": "user3", "challenged_user": "user4", "timestamp": old},
+        }
+        ChallengeManager._instance = None  # Reset singleton
+        manager = ChallengeManager()
+        manager.remove_challenge("challenge_2")
+        fresh_id = manager.create_challenge("user5", "user6")
+        
+        # Act
+        expired = manager.cleanup_expired_challenges(expiry_hours=24)
+        
+        # Assert
+        assert expired == ["challenge_1"]
+        assert manager.get_challenge("challenge_1") is None
+        assert manager.find_user_challenge("user1") is None
+        assert manager.get_challenge(fresh_id) is not None
+        assert manager.cleanup_expired_challenges(expiry_hours=24) == []
@@ -7,18 +7,27 @@ import json
 import pytest
 from unittest.mock import patch, mock_open
 
-from marbitz_battlebot.storage import load_json_file, save_json_file
+from marbitz_battlebot.storage import (
+    load_json_file, save_json_file, load_leaderboard, append_battle_deltas,
+    compact_leaderboard, journal_filename
+)
+
+# Payload shapes shared by the JSON round-trip tests
+PAYLOADS = [
+    {},
+    {'user1': {'wins': 5, 'losses': 2, 'marbles': 30}},
+    {f'üser{i}': {'wins': i, 'losses': i % 3, 'marbles': i * 10} for i in range(500)},
+]
 
 class TestStorage:
     """Tests for the storage module."""
     
-    def test_load_json_file_success(self, temp_dir):
+    @pytest.mark.parametrize("test_data", PAYLOADS)
+    def test_load_json_file_success(self, temp_dir, test_data):
         """Test loading a JSON file successfully."""
         # Arrange
         test_file = os.path.join(temp_dir, "test.json")
-        test_data = {'user1': {'wins': 5, 'losses': 2, 'marbles': 30}}
-        
-        with open(test_file, 'w') as f:
+        with open(test_file, 'w', encoding='utf-8') as f:
             json.dump(test_data, f)
         
         # Act
@@ -38,17 +47,118 @@ class TestStorage:
         # Assert
         assert result == {}
     
-    def test_save_json_file_success(self, temp_dir):
+    @pytest.mark.parametrize("test_data", PAYLOADS)
+    def test_save_json_file_success(self, temp_dir, test_data):
         """Test saving a JSON file successfully."""
         # Arrange
         test_file = os.path.join(temp_dir, "test.json")
-        test_data = {'user1': {'wins': 5, 'losses': 2, 'marbles': 30}}
         
         # Act
         save_json_file(test_data, test_file)
         
         # Assert
-        with open(test_file, 'r') as f:
+        with open(test_file, 'r', encoding='utf-8') as f:
             saved_data = json.load(f)
         
-        assert saved_data == test_data
\ No newline at end of file
+        assert saved_data == test_data
+    
+    def test_save_json_file_keeps_previous_version_as_backup(self, temp_dir):
+        """Test that saving over a file keeps its previous contents in the .bak file."""
+        # Arrange
+        test_file = os.path.join(temp_dir, "test.json")
+        save_json_file({'version': 1}, test_file)
+        
+        # Act
+        save_json_file({'version': 2}, test_file)
+        
+        # Assert
+        with open(test_file, 'r') as f:
+            assert json.load(f) == {'version': 2}
+        with open(f"{test_file}.bak", 'r') as f:
+            assert json.load(f) == {'version': 1}
+    
+    def test_save_json_file_skips_unchanged_data(self, temp_dir):
+        """Test that saving identical data again does not rewrite the file."""
+        # Arrange
+        test_file = os.path.join(temp_dir, "test.json")
+        save_json_file({'version': 1}, test_file)
+        
+        # Act
+        with patch('marbitz_battlebot.storage.os.replace') as mock_replace:
+            result = save_json_file({'version': 1}, test_file)
+        
+        # Assert
+        assert result is True
+        mock_replace.assert_not_called()
+    
+    def test_leaderboard_journal_replay_and_compaction(self, temp_dir):
+        """Test that journaled battles are replayed onto the snapshot until compacted."""
+        # Arrange
+        test_file = os.path.join(temp_dir, "leaderboard.json")
+        save_json_file({'user1': {'wins': 1, 'losses': 0, 'marbles': 10}}, test_file)
+        
+        # Act
+        append_battle_deltas([("user1", "user2", 5, 0.0), ("user2", "user1", 3, 1.0)], test_file)
+        with open(journal_filename(test_file), 'a') as f:
+            f.write('{"winner": "user1", "los')  # Partial line left by a crash
+        replayed = load_leaderboard(test_file)
+        compacted = compact_leaderboard(replayed, test_file)
+        
+        # Assert
+        assert replayed == {
+            'user1': {'wins': 2, 'losses': 1, 'marbles': 12},
+            'user2': {'wins': 1, 'losses': 1, 'marbles': -2},
+        }
+        assert compacted
+        assert not os.path.exists(journal_filename(test_file))
+        assert load_leaderboard(test_file) == replayed
+    
+    @pytest.mark.parametrize("journal_removed", [False, True])
+    def test_interrupted_compaction_counts_battles_once(self, temp_dir, journal_removed):
+        """Test that a crash during compaction neither loses nor double-counts battles."""
+        # Arrange: the compacted snapshot was written, then the process died
+        # before (journal kept) or after (journal removed) committing it
+        test_file = os.path.join(temp_dir, "leaderboard.json")
+        save_json_file({'user1': {'wins': 1, 'losses': 0, 'marbles': 10}}, test_file)
+        append_battle_deltas([("user1", "user2", 5, 0.0)], test_file)
+        expected = load_leaderboard(test_file)
+        save_json_file(expected, f"{test_file}.compact")
+        if journal_removed:
+            os.remove(journal_filename(test_file))
+        
+        # Act
+        recovered = load_leaderboard(test_file)
+        
+        # Assert
+        assert recovered == expected
+        assert not os.path.exists(f"{test_file}.compact")
+        assert os.path.exists(journal_filename(test_file)) != journal_removed
+    
+    def test_append_after_torn_journal_line(self, temp_dir):
+        """Test that a result appended after a crash-torn line is still replayed."""
+        # Arrange
+        board_file = os.path.join(temp_dir, "overall.json")
+        append_battle_deltas([("a", "b", 5, 1.0)], board_file)
+        with open(journal_filename(board_file), 'ab') as f:
+            f.write(b'{"winner": "a", "los')
+        
+        # Act
+        append_battle_deltas([("b", "a", 7, 2.0)], board_file)
+        loaded = load_leaderboard(board_file)
+        
+        # Assert
+        assert loaded["a"] == {'wins': 1, 'losses': 1, 'marbles': -2}
+        assert loaded["b"] == {'wins': 1, 'losses': 1, 'marbles': 2}
+    
+    def test_load_leaderboard_normalizes_entries(self, temp_dir):
+        """Test that invalid leaderboard entries are fixed or dropped on load."""
+        # Arrange
+        test_file = os.path.join(temp_dir, "leaderboard.json")
+        with open(test_file, 'w') as f:
+            json.dump({'user1': {'wins': 2.0, 'marbles': 'lots'}, 'user2': [1, 2]}, f)
+        
+        # Act
+        result = load_leaderboard(test_file)
+        
+        # Assert
+        assert result == {'user1': {'wins': 2, 'losses': 0, 'marbles': 0}}